@@ -0,0 +1,106 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from typing import Any, Callable
+import asyncio
+import threading
+
+from telebot.async_telebot import AsyncTeleBot
+
+
+class SyncBot:
+    ''' Синхронный фасад над AsyncTeleBot для кода обработчиков, который выполняется в потоках executor'а.
+
+    Вызов любого асинхронного метода бота (send_message, edit_message_media, ...) отправляется в цикл
+    событий через run_coroutine_threadsafe, поток ждет только свой запрос, а цикл в это время обслуживает
+    остальных пользователей. Декораторы обработчиков регистрируют синхронные функции в асинхронном боте. '''
+
+    def __init__(self, runtime: 'AsyncBotRuntime'):
+        self.runtime = runtime
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.runtime.async_bot, name)
+
+        if not asyncio.iscoroutinefunction(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            return self.runtime.run_coroutine(attr(*args, **kwargs))
+
+        return call
+
+    def message_handler(self, **kwargs):
+        def decorator(handler: Callable):
+            self.runtime.async_bot.message_handler(**kwargs)(self.runtime.wrap(handler))
+            return handler
+
+        return decorator
+
+    def callback_query_handler(self, func: Callable, **kwargs):
+        def decorator(handler: Callable):
+            self.runtime.async_bot.callback_query_handler(func=func, **kwargs)(self.runtime.wrap(handler))
+            return handler
+
+        return decorator
+
+
+class AsyncBotRuntime:
+    ''' Асинхронный рантайм бота: polling и запросы к Telegram идут в одном цикле asyncio,
+    синхронные обработчики выполняются в пуле потоков.
+
+    Обновления одного пользователя обрабатываются строго по очереди (asyncio.Lock на пользователя),
+    разные пользователи обслуживаются параллельно и не ждут сетевых запросов друг друга. '''
+
+    def __init__(self, token: str, workers: int = 32, log: Callable[[int, str, Any], None] = None):
+        self.async_bot = AsyncTeleBot(token)
+        self.bot = SyncBot(self)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='handler')
+        self.user_locks = defaultdict(asyncio.Lock)
+        self.log = log
+        self.loop = None
+        self.loop_thread = None
+
+    def run_coroutine(self, coroutine):
+        ''' Выполняет корутину в цикле рантайма и ждет результат. Вызывается только из других потоков. '''
+        if self.loop is None:
+            coroutine.close()
+            raise RuntimeError('Рантайм бота не запущен')
+
+        if threading.current_thread() is self.loop_thread:
+            coroutine.close()
+            raise RuntimeError('Синхронный вызов бота из цикла событий заблокирует его')
+
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def wrap(self, handler: Callable):
+        ''' Асинхронная обертка синхронного обработчика: очередь по пользователю и запуск в пуле потоков '''
+
+        async def run(update):
+            user_id = update.from_user.id
+
+            async with self.user_locks[user_id]:
+                try:
+                    await asyncio.get_running_loop().run_in_executor(self.executor, handler, update)
+                except Exception as err:
+                    if self.log is not None:
+                        self.log(user_id, handler.__name__, err)
+
+        run.__name__ = handler.__name__
+
+        return run
+
+    async def serve(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.current_thread()
+
+        try:
+            await self.async_bot.infinity_polling()
+        finally:
+            await self.async_bot.close_session()
+
+    def run(self) -> None:
+        ''' Запускает цикл событий и polling, блокирует до остановки бота '''
+        try:
+            asyncio.run(self.serve())
+        finally:
+            self.loop = None
+            self.executor.shutdown(wait=False, cancel_futures=True)
@@ -1,4 +1,21 @@
+class LazyPage:
+    ''' Страница меню, которая строится фабрикой только тогда, когда нужна: при переходе на нее
+    или для кнопки на текущей странице. '''
+
+    def __init__(self, page_id, factory, args=(), depends=()):
+        self.page_id = page_id
+        self.factory = factory
+        self.args = args
+        self.depends = depends
+
+
 class BaseConfigurator:
+    # ключи конфига, от которых зависит содержимое страницы, по имени фабрики страницы.
+    # по умолчанию страница зависит только от значения конфига со своим id
+    page_depends = {}
+    # сколько построенных страниц хранить
+    page_memo_size = 128
+
     def __init__(self):
         self.commands = ['back', 'reset', 'finish']
         self.reset()
@@ -8,6 +25,7 @@ class BaseConfigurator:
         self.is_done = False
         self.menu_history = ['root']
         self.current_menu_page = None
+        self.page_memo = dict()
         self.update_menu_structure()
 
     def update_menu_structure(self):
@@ -15,11 +33,42 @@ class BaseConfigurator:
 
         current_menu_page = self.menu_structure
 
+        # строятся только страницы по пути к текущей и ее дочерние страницы (для кнопок)
         for page in self.menu_history:
-            current_menu_page = current_menu_page['items'][page]
+            current_menu_page = self.resolve_page(current_menu_page['items'][page])
+
+        if isinstance(current_menu_page.get('items', None), dict):
+            current_menu_page = dict(current_menu_page)
+            current_menu_page['items'] = {key: self.resolve_page(item)
+                                          for key, item in current_menu_page['items'].items()}
 
         self.current_menu_page = current_menu_page
 
+    def lazy_page(self, page_id, factory, *args):
+        return LazyPage(page_id, factory, args, self.page_depends.get(factory.__name__, (page_id,)))
+
+    def page_ui_state(self, page_id):
+        ''' Состояние интерфейса страницы, которого нет в конфиге (например, номер страницы списка) '''
+        return None
+
+    def resolve_page(self, item):
+        ''' Строит отложенную страницу. Готовые страницы запоминаются по фабрике, ее аргументам, значениям
+         конфига, от которых страница зависит, тому, текущая ли это страница (от этого зависит заголовок),
+         и состоянию интерфейса страницы. '''
+        if not isinstance(item, LazyPage):
+            return item
+
+        key = (item.factory.__name__, item.page_id, item.args, tuple(self.config.get(k, None) for k in item.depends),
+               self.menu_history[-1] == item.page_id, self.page_ui_state(item.page_id))
+
+        if key not in self.page_memo:
+            if len(self.page_memo) >= self.page_memo_size:
+                self.page_memo.pop(next(iter(self.page_memo)))
+
+            self.page_memo[key] = item.factory(*item.args)
+
+        return self.page_memo[key]
+
     def update_menu_state(self, value, command=None):
         if command in self.commands:
             self.call_command(command)
@@ -0,0 +1,100 @@
+from typing import Iterable
+import pandas as pd
+
+from QuantileSketch import KLLSketch
+
+
+class ChunkedAggregator:
+    ''' Агрегации по файлу, который не помещается в память: данные приходят блоками, по каждому блоку
+    считаются частичные агрегаты, которые затем сливаются.
+
+    Сумма, количество и среднее (сумма / количество) считаются точно, медиана - по KLL скетчу на каждую группу
+    (ошибка ранга см. QuantileSketch.KLLSketch), value_counts - точно. В памяти одновременно находятся
+    только текущий блок и агрегаты по группам. '''
+
+    aggregations = ('mean', 'sum', 'median')
+
+    @classmethod
+    def value_counts(cls, chunks: Iterable[pd.Series]) -> pd.Series:
+        ''' value_counts по блокам, результат отсортирован по убыванию как у pd.Series.value_counts '''
+        counts = None
+
+        for chunk in chunks:
+            part = chunk.value_counts()
+            counts = part if counts is None else counts.add(part, fill_value=0)
+
+        if counts is None:
+            return pd.Series(dtype='int64')
+
+        return counts.astype('int64').sort_values(ascending=False)
+
+    @classmethod
+    def group(cls, chunks: Iterable[pd.DataFrame], key: str, value: str, agg: str = 'mean',
+              sort: bool = True) -> pd.DataFrame:
+        ''' Аналог df.groupby(key, sort=sort).agg(agg)[[value]] по блокам: индекс - значения key (по возрастанию
+        или, при sort=False, в порядке первого появления в файле), единственная колонка - агрегат value.
+        Пропуски в key отбрасываются, пропуски в value не учитываются. '''
+        if agg not in cls.aggregations:
+            raise ValueError(f'Агрегация "{agg}" не поддерживается для больших файлов')
+
+        sums, counts, sketches, order = None, None, dict(), None
+
+        for chunk in chunks:
+            grouped = chunk.groupby(key, observed=True)[value]
+
+            if not sort:
+                seen = chunk[key].dropna().drop_duplicates()
+                order = seen if order is None else pd.concat([order, seen]).drop_duplicates()
+
+            if agg == 'median':
+                for group_key, values in grouped:
+                    sketches.setdefault(group_key, KLLSketch()).update(values.to_numpy(dtype=float, na_value=float('nan')))
+
+                continue
+
+            part_sums, part_counts = grouped.sum(), grouped.count()
+            sums = part_sums if sums is None else sums.add(part_sums, fill_value=0)
+            counts = part_counts if counts is None else counts.add(part_counts, fill_value=0)
+
+        if agg == 'median':
+            result = pd.Series({group_key: sketch.quantile(0.5) for group_key, sketch in sketches.items()},
+                               dtype='float64')
+        elif sums is None:
+            result = pd.Series(dtype='float64')
+        elif agg == 'sum':
+            result = sums
+        else:
+            result = sums / counts.where(counts > 0)
+
+        if sort or order is None:
+            result = result.sort_index()
+        else:
+            result = result.reindex(pd.Index(order))
+
+        result.index.name = key
+
+        return result.to_frame(value)
+
+    @classmethod
+    def head(cls, chunks: Iterable[pd.DataFrame], n: int, sort_by: str = None, ascending: bool = True) -> pd.DataFrame:
+        ''' Аналог df.sort_values(sort_by, ascending=ascending).head(n) по блокам (без sort_by - df.head(n)).
+        В памяти одновременно находятся только текущий блок и n лучших строк, без sort_by чтение
+        останавливается, как только набралось n строк. '''
+        rows = None
+
+        for chunk in chunks:
+            if sort_by is None:
+                rows = chunk.head(n) if rows is None else pd.concat([rows, chunk.head(n - len(rows))])
+
+                if len(rows) >= n:
+                    break
+
+                continue
+
+            rows = chunk if rows is None else pd.concat([rows, chunk])
+            rows = rows.sort_values(sort_by, ascending=ascending, kind='stable').head(n)
+
+        if rows is None:
+            return pd.DataFrame()
+
+        return rows
@@ -0,0 +1,82 @@
+from typing import List, Optional
+import difflib
+import bisect
+
+
+class ColumnIndex:
+    ''' Индекс колонок файла для меню выбора колонки.
+
+    Каждой колонке выдается короткий id ('#' + номер в base36), который кладется в callback_data кнопки
+    вместо имени: размер кнопки не зависит от длины имени, а лимит Telegram в 64 байта не превышается.
+    Поиск: сначала колонки, начинающиеся с запроса (бинарный поиск по отсортированным именам),
+    затем содержащие запрос, затем похожие (difflib), все без учета регистра. '''
+
+    id_prefix = '#'
+    # сколько последних результатов поиска хранить
+    search_cache_size = 32
+
+    def __init__(self, columns: List[str]):
+        self.columns = list(columns)
+        self.ids = [self.make_id(i) for i in range(len(self.columns))]
+        self.positions = {column_id: i for i, column_id in enumerate(self.ids)}
+        self.names = {column: i for i, column in enumerate(self.columns)}
+        self.folded = [str(column).casefold() for column in self.columns]
+        self.sorted = sorted((name, i) for i, name in enumerate(self.folded))
+        self.search_cache = dict()
+
+    @classmethod
+    def make_id(cls, position: int) -> str:
+        digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+        text = ''
+
+        while True:
+            position, digit = divmod(position, 36)
+            text = digits[digit] + text
+
+            if position == 0:
+                return cls.id_prefix + text
+
+    def id_of(self, column: str) -> str:
+        return self.ids[self.names[column]]
+
+    def name_of(self, column_id: str, default: Optional[str] = None) -> Optional[str]:
+        ''' Имя колонки по id, default если это не id колонки '''
+        position = self.positions.get(column_id, None)
+
+        return default if position is None else self.columns[position]
+
+    def search(self, query: str, fuzzy_limit: int = 20) -> List[str]:
+        query = query.strip().casefold()
+
+        if not query:
+            return list(self.columns)
+
+        if query in self.search_cache:
+            return self.search_cache[query]
+
+        start = bisect.bisect_left(self.sorted, (query, -1))
+        found = []
+
+        for name, i in self.sorted[start:]:
+            if not name.startswith(query):
+                break
+
+            found.append(i)
+
+        seen = set(found)
+        found.extend(i for i, name in enumerate(self.folded) if query in name and i not in seen)
+        seen = set(found)
+
+        for name in difflib.get_close_matches(query, self.folded, n=fuzzy_limit, cutoff=0.6):
+            i = self.folded.index(name)
+
+            if i not in seen:
+                found.append(i)
+                seen.add(i)
+
+        if len(self.search_cache) >= self.search_cache_size:
+            self.search_cache.pop(next(iter(self.search_cache)))
+
+        self.search_cache[query] = [self.columns[i] for i in found]
+
+        return self.search_cache[query]
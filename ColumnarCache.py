@@ -0,0 +1,262 @@
+from typing import Iterator, List, Optional
+import pandas as pd
+import threading
+import hashlib
+import json
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+    feather = None
+
+
+class ColumnarCache:
+    ''' Колоночный кэш (Feather / Arrow IPC) рядом с исходным csv.
+
+    Прочитанные из csv колонки сохраняются в скрытый файл `.<имя>.feather` в той же директории, а рядом
+    кладется `.<имя>.meta.json` с сигнатурой исходника, списком всех колонок файла и списком колонок,
+    которые уже есть в кэше. Полный датафрейм сохраняется сразу (save), в ленивом режиме кэш пополняется
+    колонками по мере их чтения (add_columns), без отдельного разбора всего файла.
+    Файлы начинаются с точки, поэтому не попадают в список файлов пользователя.
+    Кэш пишется без сжатия, чтобы его можно было читать через memory map. '''
+
+    version = 2
+    # сколько байт с начала и с конца файла хэшируем для сигнатуры
+    sample_size = 1 << 20
+    # блокировки записи кэша по файлам (общие для всех экземпляров кэша)
+    locks = dict()
+    locks_lock = threading.Lock()
+    # посчитанные сигнатуры: путь -> ((размер, mtime), сигнатура). пока размер и mtime файла не изменились,
+    # сигнатура берется отсюда, и файл не читается заново при каждой проверке кэша
+    signatures = dict()
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled and feather is not None
+
+    def paths(self, file_path: str):
+        ''' Пути к файлу кэша и файлу с метаданными '''
+        directory, name = os.path.split(os.path.abspath(file_path))
+        return os.path.join(directory, f'.{name}.feather'), os.path.join(directory, f'.{name}.meta.json')
+
+    def signature(self, file_path: str) -> dict:
+        ''' Сигнатура файла: размер, mtime и хэш начала и конца файла '''
+        stat = os.stat(file_path)
+        key, file_id = os.path.abspath(file_path), (stat.st_size, stat.st_mtime_ns)
+
+        with self.locks_lock:
+            cached = self.signatures.get(key, None)
+
+        if cached is not None and cached[0] == file_id:
+            return cached[1]
+
+        digest = hashlib.blake2b(digest_size=16)
+
+        with open(file_path, 'rb') as f:
+            digest.update(f.read(self.sample_size))
+            if stat.st_size > 2 * self.sample_size:
+                f.seek(-self.sample_size, os.SEEK_END)
+                digest.update(f.read(self.sample_size))
+
+        signature = {
+            'version': self.version,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sample_hash': digest.hexdigest()
+        }
+
+        with self.locks_lock:
+            self.signatures[key] = (file_id, signature)
+
+        return signature
+
+    def meta(self, file_path: str) -> Optional[dict]:
+        ''' Метаданные кэша, если он есть и построен по текущему содержимому файла, иначе None '''
+        if not self.enabled or not isinstance(file_path, str) or not os.path.isfile(file_path):
+            return None
+
+        data_path, meta_path = self.paths(file_path)
+
+        if not os.path.exists(data_path) or not os.path.exists(meta_path):
+            return None
+
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if meta.get('signature', None) != self.signature(file_path):
+            return None
+
+        return meta
+
+    def has_columns(self, file_path: str, columns: List[str] = None) -> bool:
+        ''' Есть ли в кэше нужные колонки (все колонки файла, если columns не переданы) '''
+        meta = self.meta(file_path)
+
+        if meta is None:
+            return False
+
+        return set(meta['columns'] if columns is None else columns) <= set(meta['cached'])
+
+    def is_valid(self, file_path: str) -> bool:
+        ''' Кэш построен по текущему файлу и содержит все его колонки '''
+        return self.has_columns(file_path)
+
+    def load(self, file_path: str, columns: List[str] = None) -> Optional[pd.DataFrame]:
+        ''' Читает датафрейм из кэша (только нужные колонки, если переданы), None если их нет в кэше '''
+        if not self.has_columns(file_path, columns):
+            return None
+
+        data_path, _ = self.paths(file_path)
+
+        try:
+            table = feather.read_table(data_path, columns=columns, memory_map=True)
+        except Exception:
+            return None
+
+        return table.to_pandas()
+
+    def columns(self, file_path: str) -> Optional[List[str]]:
+        ''' Список колонок файла из метаданных без чтения csv, None если кэша нет '''
+        meta = self.meta(file_path)
+
+        return None if meta is None else list(meta['columns'])
+
+    def dtypes(self, file_path: str) -> Optional[dict]:
+        ''' Типы колонок (pandas) из схемы кэша без чтения данных, None если кэш неполный '''
+        if not self.is_valid(file_path):
+            return None
+
+        data_path, _ = self.paths(file_path)
+
+        try:
+            with pa.memory_map(data_path) as source:
+                return dict(pa.ipc.open_file(source).schema.empty_table().to_pandas().dtypes)
+        except Exception:
+            return None
+
+    def num_rows(self, file_path: str) -> Optional[int]:
+        ''' Число строк из кэша без чтения колонок, None если кэша нет '''
+        if self.meta(file_path) is None:
+            return None
+
+        data_path, _ = self.paths(file_path)
+
+        try:
+            return feather.read_table(data_path, columns=[], memory_map=True).num_rows
+        except Exception:
+            return None
+
+    def iter_chunks(self, file_path: str, columns: List[str], chunksize: int) -> Optional[Iterator[pd.DataFrame]]:
+        ''' Итератор по кэшу блоками по chunksize строк (через memory map), None если колонок нет в кэше '''
+        if not self.has_columns(file_path, columns):
+            return None
+
+        data_path, _ = self.paths(file_path)
+
+        try:
+            table = feather.read_table(data_path, columns=columns, memory_map=True)
+        except Exception:
+            return None
+
+        return (batch.to_pandas() for batch in table.to_batches(max_chunksize=chunksize))
+
+    def save(self, file_path: str, dataframe: pd.DataFrame) -> bool:
+        ''' Сохраняет полный датафрейм в кэш, False если сохранить не удалось (кэш необязателен) '''
+        if not self.enabled or not isinstance(file_path, str) or not os.path.isfile(file_path):
+            return False
+
+        with self.lock(file_path):
+            table = pa.Table.from_pandas(dataframe.reset_index(drop=True), preserve_index=False)
+
+            return self.write(file_path, table, list(dataframe.columns))
+
+    def add_columns(self, file_path: str, dataframe: pd.DataFrame, columns: List[str]) -> bool:
+        ''' Дописывает в кэш колонки dataframe, которых в нем еще нет. columns - все колонки файла.
+         Уже сохраненные колонки читаются через memory map, поэтому в памяти процесса оказываются
+         только новые колонки. False если дописать не удалось. '''
+        if not self.enabled or not isinstance(file_path, str) or not os.path.isfile(file_path):
+            return False
+
+        with self.lock(file_path):
+            meta = self.meta(file_path)
+            cached = list(meta['cached']) if meta is not None and meta['columns'] == list(columns) else []
+            new = [col for col in dataframe.columns if col not in cached]
+
+            if not new:
+                return True
+
+            added = pa.Table.from_pandas(dataframe[new].reset_index(drop=True), preserve_index=False)
+
+            try:
+                if cached:
+                    data_path, _ = self.paths(file_path)
+                    table = feather.read_table(data_path, columns=cached, memory_map=True)
+
+                    if table.num_rows != added.num_rows:
+                        return False
+
+                    added = pa.Table.from_arrays(table.columns + added.columns,
+                                                 names=table.column_names + added.column_names)
+            except Exception:
+                return False
+
+            return self.write(file_path, added, columns)
+
+    def add_columns_in_background(self, file_path: str, dataframe: pd.DataFrame,
+                                  columns: List[str]) -> Optional[threading.Thread]:
+        ''' add_columns в фоновом потоке, чтобы чтение колонок не ждало записи кэша '''
+        if not self.enabled or not isinstance(file_path, str):
+            return None
+
+        def run():
+            try:
+                self.add_columns(file_path, dataframe, columns)
+            except Exception:
+                pass
+
+        thread = threading.Thread(target=run, name='columnar-cache', daemon=True)
+        thread.start()
+
+        return thread
+
+    def write(self, file_path: str, table, columns: List[str]) -> bool:
+        data_path, meta_path = self.paths(file_path)
+        tmp_path = data_path + '.tmp'
+
+        try:
+            signature = self.signature(file_path)
+            cached = self.meta(file_path)
+
+            # новый файл кэша содержит все колонки старого, поэтому прежние метаданные остаются верными
+            # до записи новых. если же кэш строится заново, старые метаданные убираем сразу
+            if cached is None or not set(cached['cached']) <= set(table.column_names):
+                if os.path.exists(meta_path):
+                    os.remove(meta_path)
+
+            feather.write_feather(table, tmp_path, compression='uncompressed')
+            os.replace(tmp_path, data_path)
+
+            with open(meta_path + '.tmp', 'w') as f:
+                json.dump({'signature': signature, 'columns': list(columns), 'cached': table.column_names}, f)
+
+            os.replace(meta_path + '.tmp', meta_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+
+        return True
+
+    def lock(self, file_path: str) -> threading.Lock:
+        with self.locks_lock:
+            return self.locks.setdefault(os.path.abspath(file_path), threading.Lock())
+
+    def invalidate(self, file_path: str) -> None:
+        for path in self.paths(file_path):
+            if os.path.exists(path):
+                os.remove(path)
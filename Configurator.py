@@ -1,16 +1,50 @@
 from BaseConfigurator import BaseConfigurator
-from pandas.api.types import is_numeric_dtype
+from ColumnIndex import ColumnIndex
+import math
 
 class ConcreteConfigurator(BaseConfigurator):
+    # страницы строятся лениво и запоминаются по значениям этих ключей конфига (см. BaseConfigurator.resolve_page)
+    page_depends = {
+        'make_root_menu_structure': (),
+        'make_bar_menu_structure': (),
+        'make_bar_submenu_structure': (),
+        'make_scatter_menu_structure': (),
+        'make_scatter_submenu_structure': (),
+        'make_hist_menu_structure': (),
+        'make_hist_submenu_structure': (),
+        'make_pie_menu_structure': (),
+        'make_pie_submenu_structure': (),
+        'make_xaxis_menu_structure': ('x', 'y'),
+        'make_yaxis_menu_structure': ('x', 'y'),
+        'make_group_by_menu_structure': ('x', 'y', 'group_by'),
+        'make_agg_menu_structure': ('graph_type', 'y', 'group_by', 'agg'),
+        'make_sort_by_menu_structure': ('x', 'y', 'sort_by'),
+        'make_sort_type_menu_structure': ('sort_by', 'sort_type')
+    }
+    # страницы, значение которых - колонка: кнопки колонок передают короткий id вместо имени
+    column_pages = ('x', 'y', 'group_by', 'sort_by')
+    # страницы выбора колонки из всего файла: постраничные, с поиском по введенному тексту
+    column_picker_pages = ('x', 'y')
+    picker_commands = ('prev_page', 'next_page', 'search', 'clear_search')
+    columns_page_size = 20
+    count_titles = {'$count_y_values': 'Кол-во значений Y', '$count_x_values': 'Кол-во значений X'}
+    # сколько последних готовых графиков попадает в дашборд
+    dashboard_size = 6
+
     def __init__(self, df_container):
         self.df_container = df_container
         self.columns = df_container.get_columns()
+        self.column_index = ColumnIndex(self.columns)
+        self.picker_state = {'page': 0, 'query': None}
         self.file_name = None
+        # конфиги готовых графиков для дашборда, сбрасываются только кнопкой или сменой файла
+        self.dashboard = []
         super().__init__()
-        self.commands.append('change_file')
+        self.commands += ['change_file', 'dashboard', 'clear_dashboard']
 
     def set_file_name(self, file_name):
         self.file_name = file_name
+        self.page_memo.clear()
         self.update_menu_structure()
 
     def update_menu_state(self, value, command=None):
@@ -25,8 +59,55 @@ class ConcreteConfigurator(BaseConfigurator):
             if is_valid is False:
                 raise ValueError(error_text)
 
+        if command in self.picker_commands:
+            self.update_picker_state(value, command)
+            return self.is_done, command
+
+        # при переходе на новую страницу выбор колонки начинается с первой страницы без поиска
+        if current_menu_page_type == 'category':
+            self.reset_picker_state()
+
         return super().update_menu_state(value, command)
 
+    def update_picker_state(self, value, command):
+        if command == 'prev_page':
+            self.picker_state['page'] = max(0, self.picker_state['page'] - 1)
+        elif command == 'next_page':
+            self.picker_state['page'] += 1
+        elif command == 'search':
+            self.picker_state = {'page': 0, 'query': str(value).strip() or None}
+        elif command == 'clear_search':
+            self.reset_picker_state()
+
+        self.update_menu_structure()
+
+    def reset_picker_state(self):
+        self.picker_state = {'page': 0, 'query': None}
+
+    def go_back(self):
+        self.reset_picker_state()
+        super().go_back()
+
+    def page_ui_state(self, page_id):
+        if page_id in self.column_picker_pages and self.menu_history[-1] == page_id:
+            return self.picker_state['page'], self.picker_state['query']
+
+        if page_id == 'root':
+            return len(self.dashboard)
+
+        return None
+
+    def call_command(self, command):
+        if command == 'clear_dashboard':
+            self.dashboard = []
+            self.update_menu_structure()
+        elif command != 'dashboard':
+            super().call_command(command)
+
+    def finish(self):
+        self.dashboard = (self.dashboard + [dict(self.config)])[-self.dashboard_size:]
+        super().finish()
+
     def make_default_config(self, graph_type):
         if graph_type == 'bar':
             return self.make_bar_default_config()
@@ -50,36 +131,46 @@ class ConcreteConfigurator(BaseConfigurator):
     def make_menu_structure(self):
         return {
             'items': {
-                'root': {
-                    'title': f'Файл: {self.file_name}\nВыберите тип графика',
-                    'type': 'category',
-                    'items': {
-                        'bar': self.make_bar_menu_structure(),
-                        'hist': self.make_hist_menu_structure(),
-                        'scatter': self.make_scatter_menu_structure(),
-                        'pie': self.make_pie_menu_structure(),
-                        'change_file': {'title': 'Сменить рабочий файл', 'command': 'change_file'}
-                    },
-                    'layout': [
-                        ['bar', 'scatter'],
-                        ['hist', 'pie'],
-                        ['change_file']
-                    ]
-                }
+                'root': self.lazy_page('root', self.make_root_menu_structure)
             }
         }
 
+    def make_root_menu_structure(self):
+        structure = {
+            'title': f'Файл: {self.file_name}\nВыберите тип графика',
+            'type': 'category',
+            'items': {
+                'bar': self.lazy_page('bar', self.make_bar_menu_structure),
+                'hist': self.lazy_page('hist', self.make_hist_menu_structure),
+                'scatter': self.lazy_page('scatter', self.make_scatter_menu_structure),
+                'pie': self.lazy_page('pie', self.make_pie_menu_structure),
+                'change_file': {'title': 'Сменить рабочий файл', 'command': 'change_file'}
+            },
+            'layout': [
+                ['bar', 'scatter'],
+                ['hist', 'pie'],
+                ['change_file']
+            ]
+        }
+
+        if self.dashboard:
+            structure['items']['dashboard'] = {'title': f'Дашборд ({len(self.dashboard)})', 'command': 'dashboard'}
+            structure['items']['clear_dashboard'] = {'title': 'Очистить дашборд', 'command': 'clear_dashboard'}
+            structure['layout'].insert(2, ['dashboard', 'clear_dashboard'])
+
+        return structure
+
     def make_bar_menu_structure(self):
         return {
             'title': 'Столбчатая диаграмма',
             'type': 'category',
             'items': {
-                'x': self.make_xaxis_menu_structure('Ось X'),
-                'y': self.make_yaxis_menu_structure('Ось Y'),
-                'group_by': self.make_group_by_menu_structure(),
-                'agg': self.make_agg_menu_structure(),
-                'clean_outliers': self.make_clean_outliers_menu_structure(),
-                'bar_submenu': self.make_bar_submenu_structure(),
+                'x': self.lazy_page('x', self.make_xaxis_menu_structure, 'Ось X'),
+                'y': self.lazy_page('y', self.make_yaxis_menu_structure, 'Ось Y'),
+                'group_by': self.lazy_page('group_by', self.make_group_by_menu_structure),
+                'agg': self.lazy_page('agg', self.make_agg_menu_structure),
+                'clean_outliers': self.lazy_page('clean_outliers', self.make_clean_outliers_menu_structure),
+                'bar_submenu': self.lazy_page('bar_submenu', self.make_bar_submenu_structure),
                 'back': {'title': 'Назад', 'command': 'reset'}
             },
             'layout': [
@@ -97,14 +188,15 @@ class ConcreteConfigurator(BaseConfigurator):
             'type': 'category',
             'title': 'Дополнительно' if is_current_page else 'Далее',
             'items': {
-                'sort_by': self.make_sort_by_menu_structure(),
-                'sort_type': self.make_sort_type_menu_structure(),
-                'head': self.make_input_menu_structure('int', 'head', 'Введите целое число',
-                                                       'Взять первые n элементов'),
-                'graph_title': self.make_input_menu_structure('str', 'graph_title', 'Введите заголовок графика',
-                                                              'Заголовок графика'),
-                'xlabel': self.make_input_menu_structure('str', 'xlabel', 'Введите подпись для оси X', 'Подпись оси X'),
-                'ylabel': self.make_input_menu_structure('str', 'ylabel', 'Введите подпись для оси Y', 'Подпись оси Y'),
+                'sort_by': self.lazy_page('sort_by', self.make_sort_by_menu_structure),
+                'sort_type': self.lazy_page('sort_type', self.make_sort_type_menu_structure),
+                'head': self.make_input_page('int', 'head', 'Введите целое число',
+                                             'Взять первые n элементов'),
+                'errorbar': self.lazy_page('errorbar', self.make_errorbar_menu_structure),
+                'graph_title': self.make_input_page('str', 'graph_title', 'Введите заголовок графика',
+                                                    'Заголовок графика'),
+                'xlabel': self.make_input_page('str', 'xlabel', 'Введите подпись для оси X', 'Подпись оси X'),
+                'ylabel': self.make_input_page('str', 'ylabel', 'Введите подпись для оси Y', 'Подпись оси Y'),
                 'back': {'title': 'Назад', 'command': 'back'},
                 'finish': {'title': 'Готово', 'command': 'finish'}
             },
@@ -112,6 +204,7 @@ class ConcreteConfigurator(BaseConfigurator):
                 ['sort_by'],
                 ['sort_type'],
                 ['head'],
+                ['errorbar'],
                 ['graph_title'],
                 ['xlabel'],
                 ['ylabel'],
@@ -129,10 +222,10 @@ class ConcreteConfigurator(BaseConfigurator):
             'title': 'Точечная диаграмма',
             'type': 'category',
             'items': {
-                'x': self.make_xaxis_menu_structure('Ось X'),
-                'y': self.make_yaxis_menu_structure('Ось Y'),
-                'clean_outliers': self.make_clean_outliers_menu_structure(),
-                'scatter_submenu': self.make_scatter_submenu_structure(),
+                'x': self.lazy_page('x', self.make_xaxis_menu_structure, 'Ось X'),
+                'y': self.lazy_page('y', self.make_yaxis_menu_structure, 'Ось Y'),
+                'clean_outliers': self.lazy_page('clean_outliers', self.make_clean_outliers_menu_structure),
+                'scatter_submenu': self.lazy_page('scatter_submenu', self.make_scatter_submenu_structure),
                 'back': {'title': 'Назад', 'command': 'reset'}
             },
             'layout': [
@@ -148,17 +241,21 @@ class ConcreteConfigurator(BaseConfigurator):
             'type': 'category',
             'title': 'Дополнительно' if is_current_page else 'Далее',
             'items': {
-                'alpha': self.make_input_menu_structure('float', 'alpha', 'Введите дробное число от 0 до 1',
-                                                        'Прозрачность точек'),
-                'graph_title': self.make_input_menu_structure('str', 'graph_title', 'Введите заголовок графика',
-                                                              'Заголовок графика'),
-                'xlabel': self.make_input_menu_structure('str', 'xlabel', 'Введите подпись для оси X', 'Подпись оси X'),
-                'ylabel': self.make_input_menu_structure('str', 'ylabel', 'Введите подпись для оси Y', 'Подпись оси Y'),
+                'alpha': self.make_input_page('float', 'alpha', 'Введите дробное число от 0 до 1',
+                                              'Прозрачность точек'),
+                'scatter_mode': self.lazy_page('scatter_mode', self.make_scatter_mode_menu_structure),
+                'point_budget': self.make_input_page('int', 'point_budget', 'Введите целое число больше 0',
+                                                     'Макс. число точек'),
+                'graph_title': self.make_input_page('str', 'graph_title', 'Введите заголовок графика',
+                                                    'Заголовок графика'),
+                'xlabel': self.make_input_page('str', 'xlabel', 'Введите подпись для оси X', 'Подпись оси X'),
+                'ylabel': self.make_input_page('str', 'ylabel', 'Введите подпись для оси Y', 'Подпись оси Y'),
                 'back': {'title': 'Назад', 'command': 'back'},
                 'finish': {'title': 'Готово', 'command': 'finish'}
             },
             'layout': [
                 ['alpha'],
+                ['scatter_mode', 'point_budget'],
                 ['graph_title'],
                 ['xlabel'],
                 ['ylabel'],
@@ -176,9 +273,9 @@ class ConcreteConfigurator(BaseConfigurator):
             'title': 'Гистограмма',
             'type': 'category',
             'items': {
-                'x': self.make_xaxis_menu_structure('Ось X'),
-                'clean_outliers': self.make_clean_outliers_menu_structure(),
-                'hist_submenu': self.make_hist_submenu_structure(),
+                'x': self.lazy_page('x', self.make_xaxis_menu_structure, 'Ось X'),
+                'clean_outliers': self.lazy_page('clean_outliers', self.make_clean_outliers_menu_structure),
+                'hist_submenu': self.lazy_page('hist_submenu', self.make_hist_submenu_structure),
                 'back': {'title': 'Назад', 'command': 'reset'}
             },
             'layout': [
@@ -194,12 +291,12 @@ class ConcreteConfigurator(BaseConfigurator):
             'type': 'category',
             'title': 'Дополнительно' if is_current_page else 'Далее',
             'items': {
-                'bins': self.make_input_menu_structure('int', 'bins', 'Введите целое число', 'Количество столбцов'),
-                'discrete': self.make_discrete_menu_structure(),
-                'graph_title': self.make_input_menu_structure('str', 'graph_title', 'Введите заголовок графика',
-                                                              'Заголовок графика'),
-                'xlabel': self.make_input_menu_structure('str', 'xlabel', 'Введите подпись для оси X', 'Подпись оси X'),
-                'ylabel': self.make_input_menu_structure('str', 'ylabel', 'Введите подпись для оси Y', 'Подпись оси Y'),
+                'bins': self.make_input_page('int', 'bins', 'Введите целое число', 'Количество столбцов'),
+                'discrete': self.lazy_page('discrete', self.make_discrete_menu_structure),
+                'graph_title': self.make_input_page('str', 'graph_title', 'Введите заголовок графика',
+                                                    'Заголовок графика'),
+                'xlabel': self.make_input_page('str', 'xlabel', 'Введите подпись для оси X', 'Подпись оси X'),
+                'ylabel': self.make_input_page('str', 'ylabel', 'Введите подпись для оси Y', 'Подпись оси Y'),
                 'back': {'title': 'Назад', 'command': 'back'},
                 'finish': {'title': 'Готово', 'command': 'finish'}
             },
@@ -222,10 +319,10 @@ class ConcreteConfigurator(BaseConfigurator):
             'title': 'Круговая диаграмма',
             'type': 'category',
             'items': {
-                'x': self.make_xaxis_menu_structure('Стобец признака деления', False),
-                'y': self.make_yaxis_menu_structure('Значение'),
-                'agg': self.make_agg_menu_structure(),
-                'pie_submenu': self.make_pie_submenu_structure(),
+                'x': self.lazy_page('x', self.make_xaxis_menu_structure, 'Стобец признака деления', False),
+                'y': self.lazy_page('y', self.make_yaxis_menu_structure, 'Значение'),
+                'agg': self.lazy_page('agg', self.make_agg_menu_structure),
+                'pie_submenu': self.lazy_page('pie_submenu', self.make_pie_submenu_structure),
                 'back': {'title': 'Назад', 'command': 'reset'}
             },
             'layout': [
@@ -241,14 +338,14 @@ class ConcreteConfigurator(BaseConfigurator):
             'type': 'category',
             'title': 'Дополнительно' if is_current_page else 'Далее',
             'items': {
-                'pie_group_percent': self.make_input_menu_structure('float', 'pie_group_percent',
-                                                                    'Введите дробное число от 0 до 1',
-                                                                    'Объединять, если процент меньше'),
-                'pie_group_name': self.make_input_menu_structure('str', 'pie_group_name',
-                                                                 'Введите подпись для сгруппированных данных',
-                                                                 'Имя прочего'),
-                'graph_title': self.make_input_menu_structure('str', 'graph_title', 'Введите заголовок графика',
-                                                              'Заголовок графика'),
+                'pie_group_percent': self.make_input_page('float', 'pie_group_percent',
+                                                          'Введите дробное число от 0 до 1',
+                                                          'Объединять, если процент меньше'),
+                'pie_group_name': self.make_input_page('str', 'pie_group_name',
+                                                       'Введите подпись для сгруппированных данных',
+                                                       'Имя прочего'),
+                'graph_title': self.make_input_page('str', 'graph_title', 'Введите заголовок графика',
+                                                    'Заголовок графика'),
                 'back': {'title': 'Назад', 'command': 'back'},
                 'finish': {'title': 'Готово', 'command': 'finish'}
             },
@@ -266,42 +363,102 @@ class ConcreteConfigurator(BaseConfigurator):
         return structure
 
     def make_xaxis_menu_structure(self, title, add_count_value=True):
-        structure = self.make_menu_columns_structure()
-        structure['title'] = title
+        extra_items = dict()
 
         if add_count_value and self.config.get('y', None) != '$count_x_values':
-            structure['items']['$count_y_values'] = {'title': 'Кол-во значений Y'}
-            structure['layout'].append('$count_y_values')
+            extra_items['$count_y_values'] = {'title': self.count_titles['$count_y_values']}
+
+        structure = self.make_menu_columns_structure('x', extra_items)
+        structure['title'] = title
 
         current_value = self.config.get('x', None)
 
         if current_value is not None:
-            structure['title'] += f" \n({structure['items'][current_value]['title']})"
+            structure['title'] += f" \n({self.column_title(current_value)})"
+
+        structure['title'] += structure.pop('picker_title', '')
 
         return structure
 
     def make_yaxis_menu_structure(self, title, add_count_value=True):
-        structure = self.make_menu_columns_structure()
-        structure['title'] = title
+        extra_items = dict()
 
         if add_count_value and self.config.get('x', None) != '$count_y_values':
-            structure['items']['$count_x_values'] = {'title': 'Кол-во значений X'}
-            structure['layout'].append('$count_x_values')
+            extra_items['$count_x_values'] = {'title': self.count_titles['$count_x_values']}
+
+        structure = self.make_menu_columns_structure('y', extra_items)
+        structure['title'] = title
 
         current_value = self.config.get('y', None)
 
         if current_value is not None:
-            structure['title'] += f" \n({structure['items'][current_value]['title']})"
+            structure['title'] += f" \n({self.column_title(current_value)})"
+
+        structure['title'] += structure.pop('picker_title', '')
 
         return structure
 
-    def make_menu_columns_structure(self):
-        return {
+    def make_menu_columns_structure(self, page_id, extra_items=None):
+        # на странице только columns_page_size колонок (или найденных по запросу), кнопки - короткие id колонок.
+        # extra_items - дополнительные кнопки после колонок, каждая в своем ряду
+        is_current_page = self.menu_history[-1] == page_id
+        page, query = self.page_ui_state(page_id) or (0, None)
+        columns = self.column_index.search(query) if query else self.columns
+        pages = max(1, math.ceil(len(columns) / self.columns_page_size))
+        page = min(page, pages - 1)
+
+        if is_current_page:
+            self.picker_state['page'] = page
+
+        page_columns = columns[page * self.columns_page_size:(page + 1) * self.columns_page_size]
+        column_ids = [self.column_index.id_of(col) for col in page_columns]
+
+        structure = {
             'type': 'select',
-            'items': {col: {'title': col} for col in self.columns},
-            'layout': list(map(lambda x, y: [x, y], self.columns[0::2], self.columns[1::2]))
+            'searchable': True,
+            'items': {column_id: {'title': col} for column_id, col in zip(column_ids, page_columns)},
+            'layout': [column_ids[i:i + 2] for i in range(0, len(column_ids), 2)],
+            'picker_title': ''
         }
 
+        if is_current_page and query:
+            structure['picker_title'] = f' \nПоиск "{query}": найдено {len(columns)}, стр. {page + 1}/{pages}'
+        elif is_current_page:
+            structure['picker_title'] = f' \nСтр. {page + 1}/{pages}. Для поиска колонки введите часть названия'
+
+        for key, item in (extra_items or {}).items():
+            structure['items'][key] = item
+            structure['layout'].append(key)
+
+        navigation = []
+
+        if page > 0:
+            structure['items']['prev_page'] = {'title': '<', 'command': 'prev_page'}
+            navigation.append('prev_page')
+
+        if page < pages - 1:
+            structure['items']['next_page'] = {'title': '>', 'command': 'next_page'}
+            navigation.append('next_page')
+
+        if navigation:
+            structure['layout'].append(navigation)
+
+        if query:
+            structure['items']['clear_search'] = {'title': 'Сбросить поиск', 'command': 'clear_search'}
+            structure['layout'].append('clear_search')
+
+        return structure
+
+    def column_key(self, value):
+        ''' Ключ кнопки для значения-колонки: короткий id колонки или само значение ('None', '$count_...') '''
+        if value in self.column_index.names:
+            return self.column_index.id_of(value)
+
+        return str(value)
+
+    def column_title(self, value):
+        return self.count_titles.get(value, value)
+
     def make_group_by_menu_structure(self):
         structure = {
             'title': 'Группировать по',
@@ -320,16 +477,16 @@ class ConcreteConfigurator(BaseConfigurator):
         y = self.config.get('y', None)
 
         if y is not None and y != '$count_x_values':
-            structure['items'][y] = {'title': y}
-            structure['layout'].insert(0, y)
+            structure['items'][self.column_key(y)] = {'title': y}
+            structure['layout'].insert(0, self.column_key(y))
 
         if x is not None and x != '$count_y_values':
-            structure['items'][x] = {'title': x}
-            structure['layout'].insert(0, x)
+            structure['items'][self.column_key(x)] = {'title': x}
+            structure['layout'].insert(0, self.column_key(x))
 
         current_value = self.config.get('group_by', None)
 
-        structure['title'] += f" \n({structure['items'][str(current_value)]['title']})"
+        structure['title'] += f" \n({structure['items'][self.column_key(current_value)]['title']})"
 
         return structure
 
@@ -403,15 +560,15 @@ class ConcreteConfigurator(BaseConfigurator):
         y = self.config.get('y', None)
 
         if y is not None and y != '$count_x_values':
-            structure['items'][y] = {'title': y}
-            structure['layout'].insert(0, y)
+            structure['items'][self.column_key(y)] = {'title': y}
+            structure['layout'].insert(0, self.column_key(y))
 
         if x is not None and x != '$count_y_values':
-            structure['items'][x] = {'title': x}
-            structure['layout'].insert(0, x)
+            structure['items'][self.column_key(x)] = {'title': x}
+            structure['layout'].insert(0, self.column_key(x))
         current_value = self.config.get('sort_by', None)
 
-        structure['title'] += f" \n({structure['items'][str(current_value)]['title']})"
+        structure['title'] += f" \n({structure['items'][self.column_key(current_value)]['title']})"
 
         return structure
 
@@ -441,6 +598,9 @@ class ConcreteConfigurator(BaseConfigurator):
 
         return structure
 
+    def make_input_page(self, input_type, id, title, button_title, show_graph=True):
+        return self.lazy_page(id, self.make_input_menu_structure, input_type, id, title, button_title, show_graph)
+
     def make_input_menu_structure(self, input_type, id, title, button_title, show_graph=True):
         is_current_page = self.menu_history[-1] == id
         structure = {
@@ -463,6 +623,58 @@ class ConcreteConfigurator(BaseConfigurator):
 
         return structure
 
+    def make_errorbar_menu_structure(self):
+        structure = {
+            'title': 'Планки погрешностей',
+            'type': 'select',
+            'items': {
+                'None': {'title': 'Не показывать'},
+                'sd': {'title': 'Стандартное отклонение'},
+                'se': {'title': 'Стандартная ошибка'},
+                'ci': {'title': 'Доверительный интервал 95%'},
+                'back': {'title': 'Назад', 'command': 'back'}
+            },
+            'layout': [
+                ['None'],
+                ['sd', 'se'],
+                ['ci'],
+                ['back']
+            ],
+            'show_graph': True
+        }
+
+        current_value = self.config.get('errorbar', None)
+
+        structure['title'] += f" \n({structure['items'][str(current_value)]['title']})"
+
+        return structure
+
+    def make_scatter_mode_menu_structure(self):
+        structure = {
+            'title': 'Режим отрисовки',
+            'type': 'select',
+            'items': {
+                'auto': {'title': 'Авто'},
+                'points': {'title': 'Все точки'},
+                'density': {'title': 'Плотность'},
+                'sample': {'title': 'Выборка'},
+                'back': {'title': 'Назад', 'command': 'back'}
+            },
+            'layout': [
+                ['auto', 'points'],
+                ['density', 'sample'],
+                ['back']
+            ],
+            'show_graph': True
+        }
+
+        current_value = self.config.get('scatter_mode', None)
+
+        if current_value is not None:
+            structure['title'] += f" \n({structure['items'][current_value]['title']})"
+
+        return structure
+
     def make_discrete_menu_structure(self):
         structure = {
             'title': 'Дискретность',
@@ -497,6 +709,7 @@ class ConcreteConfigurator(BaseConfigurator):
             'sort_by': None,
             'sort_type': 'ascending',
             'head': None,
+            'errorbar': None,
             'graph_title': None,
             'xlabel': None,
             'ylabel': None
@@ -531,6 +744,8 @@ class ConcreteConfigurator(BaseConfigurator):
             'x': None,
             'y': None,
             'alpha': 0.6,
+            'scatter_mode': 'auto',
+            'point_budget': 50000,
             'clear_outliers': None,
             'graph_title': None,
             'xlabel': None,
@@ -540,6 +755,9 @@ class ConcreteConfigurator(BaseConfigurator):
     def select(self, value):
         current_menu_page_id = self.menu_history[-1]
 
+        if current_menu_page_id in self.column_pages:
+            value = self.column_index.name_of(value, value)
+
         if current_menu_page_id in ['x', 'y']:
             self.config['group_by'] = None
             self.config['sort_by'] = None
@@ -583,7 +801,7 @@ class ConcreteConfigurator(BaseConfigurator):
         if self.config['group_by'] is not None:
             aggregated_col = self.config['x'] if self.config['group_by'] == self.config['y'] else self.config['y']
 
-            if not is_numeric_dtype(self.df_container.dataframe[aggregated_col]):
+            if not self.df_container.is_numeric(aggregated_col):
                 return False, 'Применить агрегацию к полю не числового типа невозможно.'
 
         return True, None
@@ -616,4 +834,7 @@ class ConcreteConfigurator(BaseConfigurator):
         if self.config['x'] == self.config['y']:
             return False, 'Колонка X не должна быть равна колонке Y'
 
+        if self.config.get('point_budget', None) is not None and self.config['point_budget'] <= 0:
+            return False, 'Макс. число точек должно быть больше 0'
+
         return True, None
\ No newline at end of file
@@ -1,57 +1,808 @@
-from typing import Union
+from typing import Optional, Tuple, Union
+from pandas.api.types import infer_dtype, is_bool_dtype, is_integer_dtype, is_numeric_dtype, is_object_dtype, \
+    is_string_dtype
 import pandas as pd
+import numpy as np
+import threading
+import hashlib
 import io
+import os
+
+from ChunkedAggregator import ChunkedAggregator
+from ColumnarCache import ColumnarCache
+from FrameRegistry import FrameRegistry
+from LRUCache import LRUCache
+from QuantileSketch import KLLSketch, KMVSketch
+
+
+class PipelineCancelled(Exception):
+    ''' Пайплайн остановлен между стадиями: результат больше никому не нужен '''
+    pass
 
 
 class DataFrameContainer:
+    # ключи конфига, от которых зависят данные графика; остальные (заголовки, подписи, alpha) влияют только на отрисовку
+    data_config_keys = {
+        'bar': ('x', 'y', 'group_by', 'agg', 'clean_outliers', 'sort_by', 'sort_type', 'head', 'errorbar'),
+        'hist': ('x', 'y', 'clean_outliers', 'bins', 'discrete'),
+        'pie': ('x', 'y', 'group_by', 'agg', 'sort_by', 'sort_type', 'pie_group_percent', 'pie_group_name'),
+        'scatter': ('x', 'y', 'clean_outliers', 'group_by', 'agg', 'scatter_mode', 'point_budget')
+    }
+    # значения по умолчанию, которые подставляют сами методы пайплайна, если ключа нет в конфиге
+    data_config_defaults = {'agg': 'mean', 'sort_type': 'ascending', 'scatter_mode': 'auto', 'point_budget': 50_000,
+                            'bins': 10, 'discrete': False}
+    # стадии пайплайнов по типам графиков и ключи конфига, от которых зависит каждая стадия
+    pipeline_stages = {
+        'bar': ('axes', 'clean_outliers', 'group', 'sort', 'head', 'normalize', 'bar_aggregate'),
+        'hist': ('axes', 'clean_outliers', 'normalize', 'hist_values', 'hist_bins'),
+        'pie': ('axes', 'group', 'sort', 'clean_pie', 'normalize'),
+        'scatter': ('axes', 'clean_outliers', 'group', 'normalize', 'sample')
+    }
+    stage_config_keys = {
+        'axes': ('x', 'y'),
+        'clean_outliers': ('clean_outliers',),
+        'group': ('group_by', 'agg'),
+        'sort': ('sort_by', 'sort_type'),
+        'head': ('head',),
+        'clean_pie': ('pie_group_percent', 'pie_group_name'),
+        'normalize': (),
+        'stream_group': ('x', 'y', 'clean_outliers', 'group_by', 'agg', 'sort_by', 'sort_type', 'head'),
+        'stream_group_pie': ('x', 'y', 'group_by', 'agg'),
+        'sample': ('scatter_mode', 'point_budget'),
+        'hist_values': (),
+        'hist_bins': ('bins', 'discrete'),
+        'bar_aggregate': ('errorbar', 'group_by', 'sort_by', 'sort_type', 'head')
+    }
+    # стадии для потокового режима (chunked): проекция, очистка выбросов и группировка идут одним проходом по файлу
+    chunked_pipeline_stages = {
+        'bar': ('stream_group', 'sort', 'head', 'normalize', 'bar_aggregate'),
+        'pie': ('stream_group_pie', 'sort', 'clean_pie', 'normalize')
+    }
+    # стадии, которые выключаются, если первый ключ равен None
+    switchable_stages = ('group', 'sort', 'clean_pie')
+    # перцентили, которые предлагает меню очистки выбросов, считаются заранее в профиле колонки
+    profile_quantiles = (0.75, 0.90, 0.99)
+    # сколько первых строк файла читается, чтобы узнать типы колонок без профиля (см. column_dtype)
+    dtype_sample_rows = 10000
+
     # после того как пользователь выбрал конкретный файл, создаем с ним экземпляр этого класса
     # при инициализации произойдет один раз очистка и подготовка данных, merge с табличкой макрорегионов.
     # дальше уже будем вызвать методы для подготовки данных на этом экземпляре.
-    def __init__(self, file_csv: Union[bytes, str] = None):
+    # если передан путь к файлу, то повторные открытия идут через колоночный кэш, а не через разбор csv.
+    # optimize=True включает компактный режим: строки с малым числом уникальных значений становятся
+    # категориями, целые числа ужимаются до минимального типа. отчет о памяти лежит в memory_report.
+    # lazy=True - ленивый режим: при открытии читается только заголовок, колонки подгружаются
+    # (через usecols или колоночный кэш) при первом обращении из пайплайна и остаются в памяти.
+    # result_cache - общий для всех контейнеров LRU кэш готовых данных графиков (см. make_data),
+    # stage_cache - LRU кэш промежуточных результатов стадий пайплайна (см. run_pipeline), по умолчанию свой.
+    # chunked=True - режим для файлов больше памяти: столбчатые и круговые диаграммы считаются потоково блоками
+    # по chunksize строк (см. ChunkedAggregator), файл целиком в память не загружается.
+    # chunked='auto' включает этот режим, если размер файла больше memory_limit байт.
+    # quantile_mode - как считать перцентили в профиле колонок: 'exact', 'approx' (потоковый KLL скетч за один
+    # проход, без сортировки колонки) или 'auto' - приближенно, если строк больше approx_quantile_rows.
+    # registry - общий реестр датафреймов по хэшу содержимого: контейнеры с одинаковыми файлами читают одни и те же
+    # колонки (без копий), а кэши стадий и результатов у них общие, так как file_id - хэш содержимого.
+    def __init__(self, file_csv: Union[bytes, str] = None, cache: ColumnarCache = None, optimize: bool = False,
+                 lazy: bool = False, result_cache: LRUCache = None, stage_cache: LRUCache = None,
+                 quantile_mode: str = 'auto', approx_quantile_rows: int = 5_000_000, chunksize: int = 1_000_000,
+                 chunked: Union[bool, str] = False, memory_limit: int = None, registry: FrameRegistry = None):
+        self.cache = cache if cache is not None else ColumnarCache()
+        self.result_cache = result_cache
+        self.stage_cache = stage_cache if stage_cache is not None else LRUCache(max_bytes=64 << 20)
+        self.last_stages_report = None
+        self.quantile_mode = quantile_mode
+        self.approx_quantile_rows = approx_quantile_rows
+        self.chunksize = chunksize
+        self.chunked = chunked
+        self.memory_limit = memory_limit
+        self.out_of_core = False
+        self.registry = registry
+        self.content_key = None
+        self.shared = None
+        self.profile = dict()
+        self.profile_lock = threading.RLock()
+        # блокировки профилей отдельных колонок: разные колонки считаются параллельно
+        self.profile_locks = dict()
+        # типы колонок по схеме кэша или первым строкам файла, см. column_dtype
+        self.sample_dtypes = None
+        # колонки догружаются из потоков отрисовки, поэтому изменения frame идут под блокировкой.
+        # файл читается без нее, под блокировкой только подменяется frame
+        self.frame_lock = threading.RLock()
+        # сколько байт занимают колонки frame (deep), обновляется при каждом изменении frame, см. memory_usage
+        self.frame_bytes = 0
+        # увеличивается при release: колонки, прочитанные до выгрузки, в frame не добавляются
+        self.frame_generation = 0
+        self.optimize = optimize
+        self.lazy = lazy
+        self.memory_report = None
+        self.file_csv = None
+        self.file_id = None
+        self.columns = []
+        self.frame = pd.DataFrame()
+
         if file_csv:
-            if type(file_csv) is bytes:
-                file_csv = io.BytesIO(file_csv)
+            self.open(file_csv)
+
+    def open(self, file_csv: Union[bytes, str]):
+        self.file_csv = file_csv
+        self.file_id = self.make_file_id(file_csv)
+
+        if self.chunked == 'auto':
+            size = len(file_csv) if type(file_csv) is bytes else os.path.getsize(file_csv)
+            self.out_of_core = self.memory_limit is not None and size > self.memory_limit
+        else:
+            self.out_of_core = bool(self.chunked)
+
+        if self.registry is not None and not self.out_of_core:
+            self.content_key = self.registry.content_key(file_csv)
+            self.file_id = ('content', self.content_key)
+            self.shared = self.registry.acquire(self.content_key)
+
+        if self.lazy or self.out_of_core or self.shared is not None:
+            self.columns = self.read_header(file_csv)
+            self.frame = pd.DataFrame()
+
+            if not self.lazy and self.shared is not None:
+                self.load_columns(self.columns)
+        else:
+            self.dataframe = self.read_csv(file_csv)
+
+    # полный датафрейм; в ленивом режиме обращение к нему загружает все колонки.
+    @property
+    def dataframe(self) -> pd.DataFrame:
+        while True:
+            self.load_columns(self.columns)
+
+            with self.frame_lock:
+                # колонки могли выгрузить (release), пока читался файл
+                if not all(col in self.frame.columns for col in self.columns):
+                    continue
+
+                if list(self.frame.columns) != self.columns:
+                    self.frame = self.frame[self.columns]
+
+                return self.frame
+
+    @dataframe.setter
+    def dataframe(self, dataframe: pd.DataFrame):
+        frame_bytes = int(dataframe.memory_usage(deep=True).sum())
+
+        with self.frame_lock:
+            self.frame = dataframe
+            self.frame_bytes = frame_bytes
+            self.columns = list(dataframe.columns)
+
+    # датафрейм только с нужными колонками, недостающие колонки подгружаются из файла.
+    def get_frame(self, columns) -> pd.DataFrame:
+        while True:
+            self.load_columns(columns)
+
+            with self.frame_lock:
+                if all(col in self.frame.columns for col in columns):
+                    return self.frame[columns]
+
+    def load_columns(self, columns):
+        with self.frame_lock:
+            missing = [col for col in dict.fromkeys(columns) if col not in self.frame.columns]
+
+            if not missing:
+                return
+
+            # после release ссылка на общий датафрейм берется заново
+            if self.content_key is not None and self.shared is None:
+                self.shared = self.registry.acquire(self.content_key)
+
+            shared = self.shared
+            generation = self.frame_generation
+
+        if shared is not None:
+            loaded = shared.get(missing, lambda columns: self.read_csv(self.file_csv, columns))
+        else:
+            loaded = self.read_csv(self.file_csv, missing)
+
+        with self.frame_lock:
+            if self.frame_generation != generation:
+                # контейнер выгрузили во время чтения: колонки прочитаются заново вызывающим
+                return
+
+            # другой поток мог загрузить часть колонок, пока мы читали
+            missing = [col for col in missing if col not in self.frame.columns]
+
+            if not missing:
+                return
+
+            loaded = loaded[missing]
+            loaded_bytes = int(loaded.memory_usage(deep=True, index=False).sum())
+
+            if len(self.frame.columns) == 0:
+                self.frame = loaded
+            elif shared is not None:
+                self.frame = pd.concat([self.frame, loaded], axis=1)
+            else:
+                for col in missing:
+                    self.frame[col] = loaded[col]
+
+            self.frame_bytes += loaded_bytes
+
+    # сколько байт занимают загруженные колонки (deep). число обновляется при изменении frame, поэтому
+    # замер не ждет блокировку контейнера и не пересчитывается. для общего датафрейма - доля контейнера:
+    # объем общих колонок, деленный на число ссылок.
+    def memory_usage(self) -> int:
+        shared = self.shared
+
+        if shared is not None:
+            return shared.memory_usage() // max(shared.refs, 1)
+
+        return self.frame_bytes
+
+    # выгружает загруженные колонки, при следующем обращении они прочитаются заново из колоночного кэша
+    # (колонки попадают в него при первом чтении, см. read_csv). при выгрузке кэш не пишется, чтобы не занимать
+    # память, которую как раз освобождают. профиль колонок и кэши стадий не трогаются, ссылка на общий датафрейм из реестра освобождается.
+    # возвращает число освобожденных байт.
+    def release(self) -> int:
+        with self.frame_lock:
+            freed = self.memory_usage()
+            self.frame_generation += 1
+
+            if self.shared is not None:
+                self.registry.release(self.shared)
+                self.shared = None
+
+            if len(self.frame.columns) == 0:
+                return freed
+
+            self.frame = pd.DataFrame()
+            self.frame_bytes = 0
+
+            # колонки будут ужаты заново, отчет о памяти накопится снова
+            if self.lazy:
+                self.memory_report = None
+
+            return freed
+
+    def read_header(self, file_csv: Union[bytes, str]):
+        if type(file_csv) is not bytes:
+            columns = self.cache.columns(file_csv)
+
+            if columns is not None:
+                return columns
+
+            return list(pd.read_csv(file_csv, nrows=0).columns)
+
+        return list(pd.read_csv(io.BytesIO(file_csv), nrows=0).columns)
+
+    def read_csv(self, file_csv: Union[bytes, str], columns=None):
+        if type(file_csv) is bytes:
+            return self.compact(pd.read_csv(io.BytesIO(file_csv), usecols=columns))
+
+        dataframe = self.cache.load(file_csv, columns)
+
+        if dataframe is None:
+            dataframe = self.compact(pd.read_csv(file_csv, usecols=columns))
+
+            # в кэш кладем уже ужатые колонки, категории и узкие типы feather сохраняет. ужатие каждой колонки
+            # не зависит от остальных, поэтому прочитанные по отдельности колонки дописываются в кэш в фоне,
+            # без отдельного разбора всего файла. для файлов больше памяти (chunked) кэш не строится.
+            if columns is None:
+                self.cache.save(file_csv, dataframe)
+            elif not self.out_of_core:
+                self.cache.add_columns_in_background(file_csv, dataframe, self.columns)
+        elif self.optimize:
+            dataframe = self.compact(dataframe)
+
+        if columns is not None:
+            dataframe = dataframe[columns]
+
+        return dataframe
+
+    def compact(self, dataframe: pd.DataFrame) -> pd.DataFrame:
+        if not self.optimize:
+            return dataframe
+
+        dataframe, report = self.optimize_dtypes(dataframe)
+
+        # в ленивом режиме колонки ужимаются частями, поэтому отчет накапливаем
+        if self.memory_report is not None and self.lazy:
+            report = {key: self.memory_report[key] + value for key, value in report.items()}
+
+        self.memory_report = report
+
+        return dataframe
+
+    # category_ratio - максимальная доля уникальных значений от числа строк, при которой колонка становится категорией.
+    # float не трогаем: float32 меняет результат агрегаций и перцентилей.
+    @classmethod
+    def optimize_dtypes(cls, dataframe: pd.DataFrame, category_ratio: float = 0.5):
+        before = int(dataframe.memory_usage(deep=True).sum())
+        optimized = dict()
+
+        for col in dataframe.columns:
+            series = dataframe[col]
+
+            if is_object_dtype(series.dtype) or is_string_dtype(series.dtype):
+                if infer_dtype(series, skipna=True) != 'string':
+                    continue
+
+                if series.nunique(dropna=True) <= category_ratio * len(series):
+                    optimized[col] = series.astype('category')
+            elif is_integer_dtype(series.dtype):
+                downcasted = pd.to_numeric(series, downcast='integer')
+
+                if downcasted.dtype != series.dtype:
+                    optimized[col] = downcasted
+
+        if optimized:
+            dataframe = dataframe.copy(deep=False)
 
-            self.dataframe = pd.read_csv(file_csv)
+            for col, series in optimized.items():
+                dataframe[col] = series
+
+        after = int(dataframe.memory_usage(deep=True).sum())
+
+        return dataframe, {'before': before, 'after': after}
+
+    # идентификатор файла для ключей кэша: путь, размер и время изменения или хэш содержимого для байтов.
+    @staticmethod
+    def make_file_id(file_csv: Union[bytes, str]):
+        if type(file_csv) is bytes:
+            return hashlib.blake2b(file_csv, digest_size=16).hexdigest()
+
+        stat = os.stat(file_csv)
+
+        return os.path.abspath(file_csv), stat.st_size, stat.st_mtime_ns
 
     def get_columns(self):
-        return list(self.dataframe.columns)
+        return list(self.columns)
 
-    def make_bar_data(self, config):
-        df = self.make_axes(config)
-        df = self.clean_outliers(df, config)
-        df = self.group_values(df, config)
-        df = self.sort_values(df, config)
-        if config.get('head', None) is not None:
-            df = df.head(config['head'])
-        df = self.normalize_data(df, config)
+    # профиль колонки считается один раз на файл: тип, min/max, число пропусков и уникальных значений,
+    # перцентили из меню очистки выбросов. используется для порогов выбросов и валидации без повторного скана.
+    # load=False - не оставлять колонку в памяти, если она еще не загружена (профиль заранее, см. compute_profile).
+    def get_column_profile(self, col, load: bool = True):
+        with self.profile_lock:
+            if col in self.profile:
+                return self.profile[col]
 
-        return df
+            lock = self.profile_locks.setdefault(col, threading.Lock())
 
-    def make_hist_data(self, config):
-        df = self.make_axes(config)
-        df = self.clean_outliers(df, config)
-        df = self.normalize_data(df, config)
+        with lock:
+            if col not in self.profile:
+                if self.use_approx_quantiles():
+                    profile = self.make_streaming_profile(col)
+                elif load or col in self.frame.columns:
+                    profile = self.make_column_profile(self.get_frame([col])[col])
+                else:
+                    profile = self.make_column_profile(self.read_column(col))
 
-        return df
+                with self.profile_lock:
+                    self.profile[col] = profile
 
-    def make_pie_data(self, config):
-        df = self.make_axes(config)
-        df = self.group_values(df, config)
-        df = self.sort_values(df, config)
-        df = self.clean_pie(df, config)
-        df = self.normalize_data(df, config)
+        return self.profile[col]
 
-        return df
+    # колонка из кэша или файла без загрузки в frame, ужимается так же, как при загрузке
+    def read_column(self, col):
+        dataframe = None
+
+        if type(self.file_csv) is str:
+            dataframe = self.cache.load(self.file_csv, [col])
+
+        if dataframe is None:
+            file_csv = io.BytesIO(self.file_csv) if type(self.file_csv) is bytes else self.file_csv
+            dataframe = pd.read_csv(file_csv, usecols=[col])
+
+            if self.optimize:
+                dataframe = self.optimize_dtypes(dataframe)[0]
+
+            if type(self.file_csv) is str and not self.out_of_core:
+                self.cache.add_columns_in_background(self.file_csv, dataframe, self.columns)
+        elif self.optimize:
+            dataframe = self.optimize_dtypes(dataframe)[0]
+
+        return dataframe[col]
+
+    def use_approx_quantiles(self):
+        # в потоковом режиме колонки не загружаются, поэтому профиль тоже считается потоково
+        if self.out_of_core:
+            return True
+
+        if self.quantile_mode != 'auto':
+            return self.quantile_mode == 'approx'
+
+        rows = self.row_count()
+
+        return rows is not None and rows > self.approx_quantile_rows
+
+    # число строк, если его можно узнать без чтения файла
+    def row_count(self):
+        if len(self.frame.columns) > 0:
+            return len(self.frame)
+
+        if type(self.file_csv) is str:
+            return self.cache.num_rows(self.file_csv)
+
+        return None
+
+    # блоки по chunksize строк с нужными колонками: из памяти, если колонки уже загружены,
+    # иначе из колоночного кэша или потоковым чтением csv. сами колонки в памяти не остаются.
+    def iter_chunks(self, columns, chunksize: int = None):
+        chunksize = chunksize or self.chunksize
+
+        if all(col in self.frame.columns for col in columns):
+            frame = self.frame[columns]
+
+            for start in range(0, len(frame), chunksize):
+                yield frame.iloc[start:start + chunksize]
+
+            return
+
+        chunks = None
+
+        if type(self.file_csv) is str:
+            chunks = self.cache.iter_chunks(self.file_csv, columns, chunksize)
+
+        if chunks is None:
+            file_csv = io.BytesIO(self.file_csv) if type(self.file_csv) is bytes else self.file_csv
+            chunks = pd.read_csv(file_csv, usecols=columns, chunksize=chunksize)
+
+        for chunk in chunks:
+            yield chunk[columns]
+
+    # профили за один потоковый проход по всем колонкам: перцентили по KLL скетчу (ошибка ранга
+    # см. QuantileSketch.KLLSketch), количество уникальных значений - по KMV скетчу (точно, пока их меньше k,
+    # иначе nunique_approx=True), min/max и пропуски считаются точно. память не зависит от размера файла.
+    # cancelled - проверка перед каждым блоком; если она вернула True, возвращается None.
+    def make_streaming_profiles(self, columns, cancelled=None):
+        sketches = {col: KLLSketch() for col in columns}
+        distinct = {col: KMVSketch() for col in columns}
+        profiles = {col: {'dtype': None, 'is_numeric': False, 'rows': 0, 'null_count': 0, 'nunique': 0,
+                          'nunique_approx': False, 'min': None, 'max': None, 'quantiles': dict()} for col in columns}
+
+        for chunk in self.iter_chunks(columns):
+            if cancelled is not None and cancelled():
+                return None
+
+            for col, profile in profiles.items():
+                series = self.plain_dtype(chunk[col])
+
+                if profile['dtype'] is None:
+                    profile['dtype'] = str(chunk[col].dtype)
+                    profile['is_numeric'] = is_numeric_dtype(chunk[col].dtype)
+
+                profile['rows'] += len(series)
+                profile['null_count'] += int(series.isna().sum())
+                distinct[col].update(pd.util.hash_pandas_object(series.dropna(), index=False,
+                                                                categorize=False).to_numpy())
+
+                if profile['is_numeric'] and not is_bool_dtype(series.dtype):
+                    sketches[col].update(series.to_numpy(dtype=float, na_value=np.nan))
+
+        for col, profile in profiles.items():
+            profile['nunique'] = distinct[col].count()
+            profile['nunique_approx'] = not distinct[col].exact
+
+            if sketches[col].count > 0:
+                profile['min'] = sketches[col].min
+                profile['max'] = sketches[col].max
+                profile['quantiles'] = sketches[col].quantiles(self.profile_quantiles)
+
+        return profiles
+
+    def make_streaming_profile(self, col):
+        return self.make_streaming_profiles([col])[col]
+
+    # посчитать профили заранее; по умолчанию для уже загруженных колонок, background=True - в отдельном потоке.
+    # load=False - незагруженные колонки читаются только на время профиля. потоковые профили всех колонок
+    # считаются за один проход по файлу. release контейнера останавливает расчет: оставшиеся колонки
+    # посчитаются по требованию.
+    def compute_profile(self, columns=None, background: bool = False, load: bool = True):
+        if columns is None:
+            columns = [col for col in self.columns if col in self.frame.columns]
+
+        if background:
+            thread = threading.Thread(target=self.compute_profile, args=(columns, False, load), daemon=True)
+            thread.start()
+
+            return thread
+
+        generation = self.frame_generation
+
+        def cancelled():
+            return self.frame_generation != generation
+
+        with self.profile_lock:
+            columns = [col for col in dict.fromkeys(columns) if col not in self.profile]
+
+        if columns and self.use_approx_quantiles():
+            profiles = self.make_streaming_profiles(columns, cancelled)
+
+            if profiles is not None:
+                with self.profile_lock:
+                    for col, profile in profiles.items():
+                        self.profile.setdefault(col, profile)
+
+            return
+
+        for col in columns:
+            if cancelled():
+                return
+
+            self.get_column_profile(col, load)
+
+    # колонки файла, которые использует график с этим конфигом
+    def config_columns(self, config):
+        return [col for col in dict.fromkeys((config.get('x', None), config.get('y', None))) if col in self.columns]
+
+    @classmethod
+    def make_column_profile(cls, series: pd.Series):
+        profile = {
+            'dtype': str(series.dtype),
+            'is_numeric': is_numeric_dtype(series.dtype),
+            'rows': len(series),
+            'null_count': int(series.isna().sum()),
+            'nunique': int(series.nunique(dropna=True)),
+            'nunique_approx': False,
+            'min': None,
+            'max': None,
+            'quantiles': dict()
+        }
+
+        if is_numeric_dtype(series.dtype) and not is_bool_dtype(series.dtype):
+            quantiles = series.quantile(list(cls.profile_quantiles))
+            profile['min'] = series.min()
+            profile['max'] = series.max()
+            profile['quantiles'] = {q: quantiles[q] for q in cls.profile_quantiles}
+
+        return profile
+
+    # числовая ли колонка. пока профиль не посчитан, тип берется из загруженной колонки, схемы колоночного кэша
+    # или первых dtype_sample_rows строк файла: валидация меню не ждет прохода по всей колонке.
+    def is_numeric(self, col):
+        profile = self.profile.get(col, None)
+
+        if profile is not None:
+            return profile['is_numeric']
+
+        return is_numeric_dtype(self.column_dtype(col))
+
+    def column_dtype(self, col):
+        frame = self.frame
+
+        if col in frame.columns:
+            return frame[col].dtype
+
+        if self.sample_dtypes is None:
+            self.sample_dtypes = self.read_dtypes()
 
-    def make_scatter_data(self, config):
-        df = self.make_axes(config)
-        df = self.clean_outliers(df, config)
-        df = self.group_values(df, config)
-        df = self.normalize_data(df, config)
+        return self.sample_dtypes[col]
+
+    def read_dtypes(self):
+        if type(self.file_csv) is str:
+            dtypes = self.cache.dtypes(self.file_csv)
+
+            if dtypes is not None:
+                return dtypes
+
+        file_csv = io.BytesIO(self.file_csv) if type(self.file_csv) is bytes else self.file_csv
+
+        return dict(pd.read_csv(file_csv, nrows=self.dtype_sample_rows).dtypes)
+
+    # ключ кэша данных: файл, тип графика и только влияющие на данные ключи конфига с подставленными умолчаниями
+    def make_data_key(self, config):
+        graph_type = config['graph_type']
+        values = list()
+
+        for key in self.data_config_keys[graph_type]:
+            values.append(self.config_value(config, key))
+
+        return self.file_id, graph_type, tuple(values)
+
+    def config_value(self, config, key):
+        value = config.get(key, self.data_config_defaults.get(key, None))
+
+        # '0.90' и 0.9 из меню очистки выбросов - одно и то же значение
+        if key == 'clean_outliers' and value is not None:
+            value = float(value)
+
+        return value
+
+    # данные для графика из конфига; при наличии result_cache повторные вызовы с тем же набором
+    # влияющих на данные ключей не пересчитывают пайплайн. результат нельзя изменять на месте.
+    # cancelled - необязательная функция без аргументов, которая проверяется перед каждой стадией пайплайна;
+    # если она вернула True, бросается PipelineCancelled, а недосчитанный результат не попадает в result_cache.
+    def make_data(self, config, cancelled=None):
+        make = {
+            'bar': self.make_bar_data,
+            'hist': self.make_hist_data,
+            'pie': self.make_pie_data,
+            'scatter': self.make_scatter_data
+        }[config['graph_type']]
+
+        if self.result_cache is None:
+            return make(config, cancelled)
+
+        # при попадании в result_cache пайплайн не запускается, и отчет говорит, что все стадии переиспользованы
+        self.last_stages_report = self.reused_stages_report(config['graph_type'])
+
+        return self.result_cache.get_or_compute(self.make_data_key(config), lambda: make(config, cancelled))
+
+    # данные для нескольких графиков одного файла (дашборд). общие префиксы пайплайнов (проекция на колонки,
+    # очистка выбросов, группировка) считаются один раз на все графики, даже если stage_cache вытеснит их
+    # между вызовами. в last_stages_report - отчеты по каждому графику (для данных из result_cache все стадии
+    # переиспользованы, как и в make_data).
+    def make_dashboard_data(self, configs):
+        pinned = dict()
+        data = list()
+        reports = list()
+
+        for config in configs:
+            def make(config=config):
+                return self.run_pipeline(config['graph_type'], config, pinned)
+
+            self.last_stages_report = self.reused_stages_report(config['graph_type'])
+
+            if self.result_cache is None:
+                data.append(make())
+            else:
+                data.append(self.result_cache.get_or_compute(self.make_data_key(config), make))
+
+            reports.append(self.last_stages_report)
+
+        self.last_stages_report = reports
+
+        return data
+
+    # стадии пайплайна графика: в потоковом режиме для bar и pie - потоковые
+    def graph_stages(self, graph_type):
+        if self.out_of_core and graph_type in self.chunked_pipeline_stages:
+            return self.chunked_pipeline_stages[graph_type]
+
+        return self.pipeline_stages[graph_type]
+
+    def reused_stages_report(self, graph_type):
+        return {'reused': list(self.graph_stages(graph_type)), 'computed': []}
+
+    def make_bar_data(self, config, cancelled=None):
+        return self.run_pipeline('bar', config, cancelled=cancelled)
+
+    def make_hist_data(self, config, cancelled=None):
+        return self.run_pipeline('hist', config, cancelled=cancelled)
+
+    def make_pie_data(self, config, cancelled=None):
+        return self.run_pipeline('pie', config, cancelled=cancelled)
+
+    def make_scatter_data(self, config, cancelled=None):
+        return self.run_pipeline('scatter', config, cancelled=cancelled)
+
+    # значения ключей конфига, от которых зависит стадия. если стадия выключена (например group_by=None),
+    # то остальные ее ключи ни на что не влияют и в ключ кэша не попадают.
+    def stage_config_values(self, stage, config):
+        values = tuple(self.config_value(config, key) for key in self.stage_config_keys[stage])
+
+        if stage in self.switchable_stages and values[0] is None:
+            return (None,)
+
+        # сортировка и head влияют на потоковую группировку только без group_by (см. stream_group)
+        if stage == 'stream_group' and (values[3] is not None or values[7] is None):
+            return values[:5]
+
+        return values
+
+    # инкрементальный пайплайн: результат каждой стадии кэшируется по префиксу конфига, от которого он зависит
+    # (значения ключей этой стадии и всех предыдущих). пересчитываются только стадии после первой измененной.
+    # список переиспользованных и пересчитанных стадий последнего вызова лежит в last_stages_report.
+    # pinned - необязательный словарь стадий, которые не вытесняются из stage_cache на время серии вызовов
+    # (см. make_dashboard_data). cancelled - проверка отмены перед каждой стадией (см. make_data).
+    def run_pipeline(self, graph_type, config, pinned=None, cancelled=None):
+        stages = self.graph_stages(graph_type)
+        keys = list()
+        prefix = tuple()
+
+        for stage in stages:
+            prefix += ((stage, self.stage_config_values(stage, config)),)
+            keys.append((self.file_id, prefix))
+
+        # ищем самую длинную уже посчитанную цепочку стадий
+        start, df = 0, None
+        for i in range(len(stages) - 1, -1, -1):
+            if pinned is not None and keys[i] in pinned:
+                start, df = i + 1, pinned[keys[i]]
+                break
+            if keys[i] in self.stage_cache:
+                start, df = i + 1, self.stage_cache.get(keys[i])
+                break
+
+        for i in range(start, len(stages)):
+            if cancelled is not None and cancelled():
+                raise PipelineCancelled(stages[i])
+
+            df = self.run_stage(stages[i], df, config)
+            self.stage_cache.put(keys[i], df)
+
+            if pinned is not None:
+                pinned[keys[i]] = df
+
+        self.last_stages_report = {'reused': list(stages[:start]), 'computed': list(stages[start:])}
 
         return df
 
+    def run_stage(self, stage, df, config):
+        if stage == 'axes':
+            return self.make_axes(config)
+        elif stage == 'clean_outliers':
+            return self.clean_outliers(df, config)
+        elif stage == 'group':
+            return self.group_values(df, config)
+        elif stage == 'sort':
+            return self.sort_values(df, config)
+        elif stage == 'head':
+            return self.head(df, config)
+        elif stage == 'clean_pie':
+            return self.clean_pie(df, config)
+        elif stage == 'normalize':
+            return self.normalize_data(df, config)
+        elif stage == 'bar_aggregate':
+            return self.bar_aggregate(df, config)
+        elif stage == 'hist_values':
+            return self.hist_values(df)
+        elif stage == 'hist_bins':
+            return self.hist_bins(df, config)
+        elif stage == 'sample':
+            return self.sample_points(df, config)
+        elif stage == 'stream_group':
+            return self.stream_group(config)
+        elif stage == 'stream_group_pie':
+            return self.stream_group(dict(config, clean_outliers=None, head=None))
+
+    # потоковый аналог make_axes -> clean_outliers -> group_values: один проход по файлу блоками.
+    # без group_by, как и в памяти, head относится к строкам: блоки отдают первые n строк (или n строк
+    # после сортировки по sort_by), а усредняет их дальше bar_aggregate. без group_by и без head строки
+    # сразу усредняются по категории так же, как в bar_aggregate (строковые категории - в порядке первого
+    # появления, числовые - по возрастанию); sort_by тогда упорядочивает уже усредненные столбцы - по тому же
+    # правилу bar_aggregate сортирует их и в памяти.
+    def stream_group(self, config):
+        x, y = config.get('x', None), config.get('y', None)
+
+        if x == '$count_y_values':
+            return ChunkedAggregator.value_counts(self.plain_dtype(chunk[y]) for chunk in self.iter_chunks([y]))
+
+        if y == '$count_x_values':
+            return ChunkedAggregator.value_counts(self.plain_dtype(chunk[x]) for chunk in self.iter_chunks([x]))
+
+        group_by = config.get('group_by', None)
+        percent = config.get('clean_outliers', None)
+        bounds = dict()
+
+        if percent is not None:
+            bounds = {col: self.outlier_bounds(None, col, float(percent)) for col in (x, y)}
+
+        if group_by is None and config.get('head', None) is not None:
+            sort_by = config.get('sort_by', None)
+
+            def rows():
+                for chunk in self.iter_chunks([x, y]):
+                    chunk = self.filter_outliers(chunk, bounds)
+                    yield chunk if sort_by is None else chunk.assign(**{sort_by: self.plain_dtype(chunk[sort_by])})
+
+            return ChunkedAggregator.head(rows(), config['head'], sort_by,
+                                          self.config_value(config, 'sort_type') == 'ascending')
+
+        key, value = group_by or x, y
+        agg, sort = self.config_value(config, 'agg'), True
+
+        if group_by is None:
+            numeric_x, numeric_y = (is_numeric_dtype(dtype) and not is_bool_dtype(dtype)
+                                    for dtype in (self.column_dtype(x), self.column_dtype(y)))
+            key, value = (y, x) if numeric_x and not numeric_y else (x, y)
+            agg, sort = 'mean', is_numeric_dtype(self.column_dtype(key))
+        elif key != x:
+            value = x
+
+        def chunks():
+            for chunk in self.iter_chunks([x, y]):
+                chunk = self.filter_outliers(chunk, bounds)
+                yield chunk.assign(**{key: self.plain_dtype(chunk[key])})
+
+        return ChunkedAggregator.group(chunks(), key, value, agg, sort)
+
     def make_axes(self, config):
         columns = list()
 
@@ -63,13 +814,13 @@ class DataFrameContainer:
         if y is not None and y != '$count_x_values':
             columns.append(y)
 
-        df = self.dataframe[columns]
+        df = self.get_frame(columns)
 
         if x == '$count_y_values':
-            df = df[y].value_counts()
+            df = self.plain_dtype(df[y]).value_counts()
 
         if y == '$count_x_values':
-            df = df[x].value_counts()
+            df = self.plain_dtype(df[x]).value_counts()
 
         return df
 
@@ -79,32 +830,38 @@ class DataFrameContainer:
 
         if percent is not None:
             percent = float(percent)
-            point_desc = df.describe([percent])
-            percent_str = f'{int(percent * 100)}%'
+            # пороги считаем по исходным колонкам до фильтрации, поэтому сначала собираем их для обеих осей
+            bounds = {col: self.outlier_bounds(df, col, percent) for col in (x, y) if col is not None}
+            df = self.filter_outliers(df, bounds)
 
-            if x is not None:
-                point = point_desc[point_desc.index == percent_str][x][0]
-                max_point = point_desc[point_desc.index == 'max'][x][0]
-                min_point = point_desc[point_desc.index == 'min'][x][0]
+        return df
 
-                # убираем выбросы сверху или наоборот по x
-                if max_point - point >= point - min_point:
-                    df = df[df[x] <= point]
-                else:
-                    df = df[df[x] >= point]
+    def filter_outliers(self, df, bounds):
+        for col, (point, min_point, max_point) in bounds.items():
+            # убираем выбросы сверху или наоборот
+            if max_point - point >= point - min_point:
+                df = df[df[col] <= point]
+            else:
+                df = df[df[col] >= point]
 
-            if y is not None:
-                point = point_desc[point_desc.index == percent_str][y][0]
-                max_point = point_desc[point_desc.index == 'max'][y][0]
-                min_point = point_desc[point_desc.index == 'min'][y][0]
+        return df
 
-                # убираем выбросы сверху или наоборот по y
-                if max_point - point >= point - min_point:
-                    df = df[df[y] <= point]
-                else:
-                    df = df[df[y] >= point]
+    # перцентиль, минимум и максимум колонки для очистки выбросов. если df - это еще не отфильтрованная
+    # проекция исходных колонок (или None в потоковом режиме), то значения берутся из профиля колонки
+    # без повторного прохода по данным.
+    def outlier_bounds(self, df, col, percent):
+        if (df is None or type(df) is pd.DataFrame) and col in self.columns:
+            profile = self.get_column_profile(col)
 
-        return df
+            if (df is None or profile['rows'] == len(df)) and percent in profile['quantiles']:
+                return profile['quantiles'][percent], profile['min'], profile['max']
+
+        if df is None:
+            raise ValueError(f'Для колонки "{col}" нельзя посчитать перцентиль')
+
+        column = df[col]
+
+        return column.quantile(percent), column.min(), column.max()
 
     def clean_pie(self, df, config):
         if config.get('pie_group_percent', None) is not None:
@@ -136,16 +893,160 @@ class DataFrameContainer:
             if type(df) is pd.Series:
                 df = df.sort_values(ascending=ascending)
             else:
-                df = df.sort_values(by=config['sort_by'], ascending=ascending)
+                df = df.sort_values(by=config['sort_by'], ascending=ascending, key=self.plain_dtype, kind='stable')
+
+        return df
+
+    def head(self, df, config):
+        if config.get('head', None) is not None:
+            df = df.head(config['head'])
 
         return df
 
     def group_values(self, df, config):
         if config.get('group_by', None) is not None:
-            df = df.groupby(config['group_by']).agg(config.get('agg', 'mean'))
+            df = df.groupby(config['group_by'], observed=True).agg(config.get('agg', 'mean'))
+
+            if isinstance(df.index, pd.CategoricalIndex):
+                df.index = df.index.astype(df.index.categories.dtype)
 
         return df
 
+    # в режиме scatter_mode='sample' оставляем около point_budget точек: стратифицированная выборка
+    # по сетке grid x grid (каждая непустая ячейка сохраняет хотя бы одну точку, так что редкие области
+    # и выбросы не пропадают) плюс строки с минимумом и максимумом по каждой оси. значения нечисловой оси
+    # раскладываются по grid корзинам, а ячеек не больше point_budget / 2, поэтому и при уникальных
+    # значениях на оси обязательные точки из каждой ячейки не выходят за point_budget.
+    def sample_points(self, df, config, grid=64):
+        point_budget = self.config_value(config, 'point_budget') or self.data_config_defaults['point_budget']
+
+        if self.config_value(config, 'scatter_mode') != 'sample' or len(df) <= point_budget:
+            return df
+
+        grid = max(1, min(grid, int(np.sqrt(point_budget / 2))))
+
+        rng = np.random.default_rng(0)
+        cells = np.zeros(len(df), dtype='int64')
+        extrema = set()
+
+        for col in ('x', 'y'):
+            if col not in df.columns:
+                continue
+
+            values = df[col]
+
+            if is_numeric_dtype(values.dtype) and not is_bool_dtype(values.dtype):
+                extrema.update([values.idxmin(), values.idxmax()])
+                low, high = values.min(), values.max()
+                scale = grid / (high - low) if high > low else 0
+                codes = ((values - low) * scale).clip(0, grid - 1).fillna(-1).to_numpy(dtype='int64')
+            else:
+                codes, uniques = pd.factorize(values)
+
+                if len(uniques) > grid:
+                    codes = np.where(codes >= 0, codes * grid // len(uniques), -1)
+
+            cells = cells * (codes.max() + 2) + codes + 1
+
+        cells = pd.Series(pd.factorize(cells)[0])
+        sizes = cells.map(cells.value_counts())
+        quota = np.maximum(1, np.round(sizes * (point_budget / len(df)))).to_numpy()
+
+        # случайный порядок внутри ячеек, из каждой ячейки берем первые quota строк
+        order = rng.permutation(len(df))
+        rank = np.empty(len(df), dtype='int64')
+        rank[order] = cells.iloc[order].groupby(cells.iloc[order].to_numpy()).cumcount().to_numpy()
+
+        mask = rank < quota
+        mask[[df.index.get_loc(i) for i in extrema if not pd.isna(i)]] = True
+
+        return df[mask].reset_index(drop=True)
+
+    # по одному столбцу на каждое значение категориальной оси: среднее по строкам с этим значением (как estimator
+    # у sns.barplot), порядок тоже как у barplot - по появлению, для числовой оси по возрастанию.
+    # ось значений, как и у barplot, горизонтальная, если x числовой, а y нет. errorbar (None по умолчанию)
+    # добавляет колонку err: 'sd' - стандартное отклонение, 'se' - стандартная ошибка,
+    # 'ci' - 95% доверительный интервал в нормальном приближении (1.96 * se) вместо бутстрэпа barplot.
+    # без group_by и head сортировка sort_by упорядочивает уже усредненные столбцы, как и в потоковом режиме
+    # (см. stream_group), а не строки до усреднения.
+    def bar_aggregate(self, df, config):
+        errorbar = config.get('errorbar', None)
+
+        if 'x' not in df.columns or 'y' not in df.columns:
+            return df
+
+        numeric_x, numeric_y = (is_numeric_dtype(df[col].dtype) and not is_bool_dtype(df[col].dtype)
+                                for col in ('x', 'y'))
+        category, value = ('y', 'x') if numeric_x and not numeric_y else ('x', 'y')
+
+        if not is_numeric_dtype(df[value].dtype) or is_bool_dtype(df[value].dtype):
+            return df
+
+        if df[category].is_unique and errorbar is None:
+            return df
+
+        grouped = df.groupby(category, sort=is_numeric_dtype(df[category].dtype), observed=True)[value]
+        result = grouped.mean().reset_index()
+
+        if errorbar == 'sd':
+            result['err'] = grouped.std().to_numpy()
+        elif errorbar == 'se':
+            result['err'] = grouped.sem().to_numpy()
+        elif errorbar == 'ci':
+            result['err'] = 1.96 * grouped.sem().to_numpy()
+
+        sort_by = config.get('sort_by', None)
+
+        if sort_by is not None and config.get('group_by', None) is None and config.get('head', None) is None:
+            result = result.sort_values('x' if sort_by == config.get('x', None) else 'y', kind='stable',
+                                        ascending=self.config_value(config, 'sort_type') == 'ascending')
+
+        return result[['x', 'y'] + (['err'] if 'err' in result.columns else [])]
+
+    # значения для гистограммы без пропусков: числа отсортированы (min/max - крайние элементы), поэтому
+    # при смене количества столбцов счетчики считаются бинарным поиском по границам, без прохода по данным.
+    def hist_values(self, df):
+        values = self.plain_dtype(df['x']).dropna()
+
+        if is_numeric_dtype(values.dtype) and not is_bool_dtype(values.dtype):
+            return values.sort_values(ignore_index=True)
+
+        return values.reset_index(drop=True)
+
+    # счетчики гистограммы: x - левая граница столбца, width - ширина, y - количество значений.
+    # границы как у sns.histplot: bins равных интервалов между min и max, при discrete - по столбцу на каждое целое.
+    # для нечисловых колонок - количество значений каждой категории в порядке появления.
+    def hist_bins(self, values, config):
+        bins = self.config_value(config, 'bins') or self.data_config_defaults['bins']
+        discrete = self.config_value(config, 'discrete')
+
+        if not is_numeric_dtype(values.dtype) or is_bool_dtype(values.dtype):
+            counts = values.value_counts(sort=False)
+
+            return pd.DataFrame({'x': counts.index, 'width': 0.8, 'y': counts.to_numpy()})
+
+        if len(values) == 0:
+            return pd.DataFrame({'x': [], 'width': [], 'y': []})
+
+        array = values.to_numpy()
+        low, high = array[0], array[-1]
+
+        if discrete and is_integer_dtype(array.dtype):
+            counts = np.bincount(array.astype('int64') - low)
+            edges = np.arange(int(low), int(high) + 2) - 0.5
+        else:
+            if discrete:
+                edges = np.arange(low - 0.5, high + 1.5)
+            else:
+                edges = np.linspace(low, high, bins + 1) if high > low else np.array([low - 0.5, low + 0.5])
+
+            # как в np.histogram: интервалы [a, b), последний - [a, b]
+            positions = np.searchsorted(array, edges, side='left')
+            positions[-1] = np.searchsorted(array, edges[-1], side='right')
+            counts = np.diff(positions)
+
+        return pd.DataFrame({'x': edges[:-1], 'width': np.diff(edges), 'y': counts})
+
     def normalize_data(self, df, config):
         if type(df) is pd.Series:
             x, y = None, None
@@ -165,26 +1066,74 @@ class DataFrameContainer:
             normalized_df = pd.DataFrame()
 
             if x is not None:
-                normalized_df['x'] = df[x]
+                normalized_df['x'] = self.plain_dtype(df[x])
             if y is not None:
-                normalized_df['y'] = df[y]
+                normalized_df['y'] = self.plain_dtype(df[y])
 
             return normalized_df
 
+    # после optimize_dtypes возвращаем колонке тип, который дал бы read_csv, там где от типа зависит результат
+    # (порядок value_counts и сортировки, подписи и порядок столбцов на графике, тип готовых данных).
+    @staticmethod
+    def plain_dtype(series: pd.Series) -> pd.Series:
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            return series.astype(series.cat.categories.dtype)
+
+        if is_integer_dtype(series.dtype) and series.dtype.itemsize < 8:
+            return series.astype('uint64' if series.dtype.kind == 'u' else 'int64')
+
+        return series
+
     # статический метод, обращаемся к нему без создания экземпляра класса при загрузке пользователем файла.
     # если файл невалиден, то не сохраняем его.
     # downloaded_file из бота это поток байтов, поэтому сначала надо его преобразовать.
     # для совместимости оставил возможность передать просто строчку (вдруг где-то еще пригодится).
     @classmethod
     def validate_csv(cls, file: Union[bytes, str]):
+        is_valid, _ = cls.check_csv(file)
+
+        return is_valid
+
+    # быстрая проверка: читаем только заголовок и первые sample_rows строк, чтобы отбраковать
+    # явно плохой файл до полного разбора. возвращает (валиден ли файл, текст ошибки).
+    @classmethod
+    def check_csv(cls, file: Union[bytes, str], sample_rows: int = 1000) -> Tuple[bool, Optional[str]]:
         if type(file) is bytes:
             file = io.BytesIO(file)
 
         try:
-            dataframe = pd.read_csv(file)
-        except:
-            return False
+            sample = pd.read_csv(file, nrows=sample_rows)
+        except pd.errors.EmptyDataError:
+            return False, 'Файл пустой.'
+        except UnicodeDecodeError:
+            return False, 'Не удалось прочитать файл: неизвестная кодировка.'
+        except Exception:
+            return False, 'Не удалось разобрать файл как csv.'
+
+        if len(sample.columns) == 0:
+            return False, 'В файле не найдено ни одной колонки.'
 
-        # TODO: проверить файл, если надо
+        if len(sample) == 0:
+            return False, 'В файле нет данных, только заголовок.'
+
+        return True, None
+
+    # проверка и загрузка за один разбор файла: возвращает (готовый контейнер, None) или (None, текст ошибки).
+    # если для файла уже есть колоночный кэш (хотя бы часть колонок), то проверку пропускаем - файл уже однажды загружался.
+    @classmethod
+    def load_csv(cls, file: Union[bytes, str], sample_rows: int = 1000,
+                 **kwargs) -> Tuple[Optional['DataFrameContainer'], Optional[str]]:
+        container = cls(**kwargs)
+
+        if type(file) is bytes or container.cache.columns(file) is None:
+            is_valid, error_text = cls.check_csv(file, sample_rows)
+
+            if not is_valid:
+                return None, error_text
+
+        try:
+            container.open(file)
+        except Exception:
+            return None, 'Не удалось разобрать файл как csv.'
 
-        return True
+        return container, None
@@ -0,0 +1,129 @@
+from typing import Callable, Optional, Tuple
+import hashlib
+import time
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class DownloadError(Exception):
+    ''' Файл не удалось скачать: текст ошибки можно показывать пользователю '''
+
+
+class StreamingDownloader:
+    ''' Потоковое скачивание файлов по ссылке через общий requests.Session с пулом соединений.
+
+    Тело ответа пишется на диск блоками во временный `<путь>.part` и переименовывается в итоговый файл
+    только после успешного скачивания, в памяти держится один блок. Ограничения: max_bytes на размер
+    (проверяется и по Content-Length, и по факту), connect/read таймауты на соединение и на каждый блок,
+    total_timeout на все скачивание. Пока файл качается, первые sample_bytes проверяются функцией check
+    (например, DataFrameContainer.check_csv), и заведомо плохой файл не докачивается. '''
+
+    def __init__(self, max_bytes: int = 2 << 30, connect_timeout: float = 10, read_timeout: float = 30,
+                 total_timeout: float = 600, chunk_size: int = 1 << 16, sample_bytes: int = 1 << 20,
+                 pool_size: int = 16):
+        self.max_bytes = max_bytes
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.total_timeout = total_timeout
+        self.chunk_size = chunk_size
+        self.sample_bytes = sample_bytes
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @staticmethod
+    def complete_lines(sample: bytes) -> bytes:
+        ''' Начало файла без последней, возможно оборванной, строки '''
+        end = sample.rfind(b'\n')
+
+        return sample if end == -1 else sample[:end + 1]
+
+    def download(self, url: str, path: str, progress: Callable[[int, Optional[int]], None] = None,
+                 check: Callable[[bytes], Tuple[bool, Optional[str]]] = None) -> dict:
+        ''' Скачивает url в path. progress(скачано байт, размер или None) вызывается после каждого блока,
+         check(начало файла) возвращает (валиден ли файл, текст ошибки). Возвращает путь, размер и хэш. '''
+        started = time.monotonic()
+        tmp_path = path + '.part'
+        directory = os.path.dirname(path)
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        try:
+            with self.session.get(url, stream=True, timeout=(self.connect_timeout, self.read_timeout)) as response:
+                response.raise_for_status()
+
+                total = int(response.headers.get('Content-Length', 0) or 0) or None
+
+                if total is not None and total > self.max_bytes:
+                    raise DownloadError(f'файл слишком большой ({total >> 20} МБ, максимум {self.max_bytes >> 20} МБ)')
+
+                result = self.write_stream(response.iter_content(self.chunk_size), tmp_path, started, total,
+                                           progress, check)
+
+            os.replace(tmp_path, path)
+        except requests.Timeout:
+            raise DownloadError('сервер слишком долго не отвечает')
+        except requests.RequestException as err:
+            raise DownloadError(f'ошибка соединения ({type(err).__name__})')
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        result['path'] = path
+
+        return result
+
+    def write_stream(self, chunks, tmp_path: str, started: float, total: Optional[int],
+                     progress: Callable[[int, Optional[int]], None] = None,
+                     check: Callable[[bytes], Tuple[bool, Optional[str]]] = None) -> dict:
+        ''' Пишет блоки в tmp_path, считая размер, хэш и проверяя начало файла '''
+        size = 0
+        digest = hashlib.blake2b(digest_size=16)
+        sample = bytearray() if check is not None else None
+
+        with open(tmp_path, 'wb') as f:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+
+                size += len(chunk)
+
+                if size > self.max_bytes:
+                    raise DownloadError(f'файл слишком большой (максимум {self.max_bytes >> 20} МБ)')
+
+                if time.monotonic() - started > self.total_timeout:
+                    raise DownloadError('скачивание заняло слишком много времени')
+
+                f.write(chunk)
+                digest.update(chunk)
+
+                if sample is not None:
+                    sample += chunk
+
+                    if len(sample) >= self.sample_bytes:
+                        self.check_sample(check, self.complete_lines(bytes(sample)))
+                        sample = None
+
+                if progress is not None:
+                    progress(size, total)
+
+        # файл меньше sample_bytes проверяем целиком
+        if sample is not None:
+            self.check_sample(check, bytes(sample))
+
+        return {'size': size, 'hash': digest.hexdigest()}
+
+    @staticmethod
+    def check_sample(check: Callable[[bytes], Tuple[bool, Optional[str]]], sample: bytes) -> None:
+        is_valid, error_text = check(sample)
+
+        if not is_valid:
+            raise DownloadError(error_text)
+
+    def close(self) -> None:
+        self.session.close()
@@ -0,0 +1,130 @@
+from typing import Callable, Dict, List, Union
+import pandas as pd
+import threading
+import hashlib
+import os
+
+
+class SharedFrame:
+    ''' Неизменяемый набор колонок одного файла, общий для всех контейнеров, открывших файл с тем же содержимым.
+
+    Колонки подгружаются по мере надобности один раз на всех, контейнеры собирают из них свои датафреймы.
+    При copy-on-write (в pandas 3 включен всегда, в pandas 2 его включает приложение, см. main_v1.Main.warm_up)
+    pd.concat не копирует данные, а изменения в стадиях пайплайна копируют их, общие колонки остаются
+    нетронутыми. Без copy-on-write get возвращает копию, так что общие колонки тоже не меняются. '''
+
+    def __init__(self, key: str):
+        self.key = key
+        self.columns: Dict[str, pd.Series] = dict()
+        self.refs = 0
+        # (число колонок, байты) последнего замера памяти
+        self.usage = (0, 0)
+        self.lock = threading.RLock()
+
+    def get(self, columns: List[str], load: Callable[[List[str]], pd.DataFrame]) -> pd.DataFrame:
+        ''' Датафрейм из нужных колонок, недостающие загружаются через load(columns).
+         Файл читается без блокировки, чтобы замер памяти и другие контейнеры не ждали чтения. '''
+        with self.lock:
+            missing = [col for col in dict.fromkeys(columns) if col not in self.columns]
+
+        if missing:
+            loaded = load(missing)
+
+            with self.lock:
+                # если колонку параллельно загрузил другой контейнер, остается первая
+                for col in missing:
+                    self.columns.setdefault(col, loaded[col])
+
+        with self.lock:
+            series = [self.columns[col] for col in dict.fromkeys(columns)]
+
+        if not copy_on_write():
+            return pd.concat(series, axis=1).copy()
+
+        return pd.concat(series, axis=1)
+
+    def memory_usage(self) -> int:
+        with self.lock:
+            usage = self.usage
+            series = list(self.columns.values())
+
+        if usage[0] != len(series):
+            usage = (len(series), sum(int(item.memory_usage(deep=True, index=False)) for item in series))
+            self.usage = usage
+
+        return usage[1]
+
+
+def copy_on_write() -> bool:
+    if int(pd.__version__.split('.')[0]) >= 3:
+        return True
+
+    # в pandas 2.2 значение 'warn' только предупреждает, copy-on-write при этом выключен
+    return pd.get_option('mode.copy_on_write') is True
+
+
+class FrameRegistry:
+    ''' Реестр общих датафреймов по хэшу содержимого файла.
+
+    Одинаковые файлы (например, тестовый kiva_loans.csv или один и тот же файл, загруженный разными
+    пользователями) разбираются один раз, контейнеры держат ссылку на SharedFrame. Когда последний
+    контейнер освобождает ссылку, данные удаляются из реестра. '''
+
+    block_size = 1 << 20
+
+    def __init__(self):
+        self.frames: Dict[str, SharedFrame] = dict()
+        # (путь, размер, mtime) -> хэш, чтобы не хэшировать один и тот же файл при каждом открытии
+        self.hashes = dict()
+        self.lock = threading.RLock()
+
+    def content_key(self, file_csv: Union[bytes, str]) -> str:
+        if type(file_csv) is bytes:
+            return hashlib.blake2b(file_csv, digest_size=16).hexdigest()
+
+        stat = os.stat(file_csv)
+        file_id = (os.path.abspath(file_csv), stat.st_size, stat.st_mtime_ns)
+
+        with self.lock:
+            if file_id in self.hashes:
+                return self.hashes[file_id]
+
+        digest = hashlib.blake2b(digest_size=16)
+
+        with open(file_csv, 'rb') as f:
+            for block in iter(lambda: f.read(self.block_size), b''):
+                digest.update(block)
+
+        with self.lock:
+            self.hashes[file_id] = digest.hexdigest()
+
+        return self.hashes[file_id]
+
+    def remember(self, file_csv: str, key: str) -> None:
+        ''' Запоминает уже посчитанный хэш файла (например, при скачивании), чтобы не читать файл повторно '''
+        stat = os.stat(file_csv)
+
+        with self.lock:
+            self.hashes[(os.path.abspath(file_csv), stat.st_size, stat.st_mtime_ns)] = key
+
+    def acquire(self, key: str) -> SharedFrame:
+        with self.lock:
+            frame = self.frames.setdefault(key, SharedFrame(key))
+            frame.refs += 1
+
+            return frame
+
+    def release(self, frame: SharedFrame) -> None:
+        with self.lock:
+            frame.refs -= 1
+
+            if frame.refs <= 0:
+                self.frames.pop(frame.key, None)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'frames': len(self.frames),
+                'refs': sum(frame.refs for frame in self.frames.values()),
+                'bytes': sum(frame.memory_usage() for frame in self.frames.values())
+            }
@@ -1,38 +1,226 @@
-import numpy as np
-import pandas as pd
+from __future__ import annotations
 
-import matplotlib.pyplot as plt
-import seaborn as sns
+import numpy as np
 
-plt.style.use('seaborn-darkgrid')
-plt.switch_backend('agg')
-palette = plt.get_cmap('Set2')
+from contextlib import contextmanager
+import functools
+import threading
 
 from typing import List, Optional, Tuple, Union
 from typing import Literal
 
 StrOrStrList = Union[str, List[str]]
 
+# matplotlib, seaborn and pandas are imported by load_plotting before the first drawing
+plt = sns = pd = None
+LogNorm = Figure = FigureCanvasAgg = None
+is_bool_dtype = is_numeric_dtype = None
+palette = None
+default_colors = None
+plotting_lock = threading.Lock()
+
+
+def load_plotting():
+    '''
+    Imports plotting libraries and applies the plot style once per process. Importing the module stays cheap,
+    call it in advance (for example in a background thread) to warm the process up.
+    '''
+
+    global plt, sns, pd, LogNorm, Figure, FigureCanvasAgg, is_bool_dtype, is_numeric_dtype, palette, default_colors
+
+    if plt is not None:
+        return
+
+    with plotting_lock:
+        if plt is not None:
+            return
+
+        import matplotlib
+        matplotlib.use('agg')
+
+        import matplotlib.pyplot as pyplot
+        import pandas
+        import seaborn
+        from matplotlib.backends.backend_agg import FigureCanvasAgg as canvas
+        from matplotlib.colors import LogNorm as log_norm
+        from matplotlib.figure import Figure as figure
+        from pandas.api.types import is_bool_dtype as is_bool, is_numeric_dtype as is_numeric
+
+        pyplot.style.use('seaborn-darkgrid')
+
+        sns, pd = seaborn, pandas
+        LogNorm, Figure, FigureCanvasAgg = log_norm, figure, canvas
+        is_bool_dtype, is_numeric_dtype = is_bool, is_numeric
+        palette = pyplot.get_cmap('Set2')
+        default_colors = seaborn.color_palette('pastel')
+        # plt is assigned last: other threads skip the lock only when everything is loaded
+        plt = pyplot
+
+
+def plotting(method):
+    '''
+    Decorator for drawing methods: loads plotting libraries before the call.
+    '''
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        load_plotting()
+
+        return method(*args, **kwargs)
+
+    return wrapper
+
+
+class FigureManager:
+    '''
+      Pool of reusable matplotlib figures, which are not registered in pyplot.
+    '''
+
+    def __init__(self, pool_size=2):
+        '''
+        Initialize the manager.
+
+        Prameters:
+          pool_size: int, default 2
+            Max number of released figures kept for reuse. Each figure keeps its Agg canvas buffer,
+            so reusing a figure of the same size skips the buffer allocation.
+        '''
+
+        self.pool_size = pool_size
+        self.pool: List[Figure] = []
+        self.live = set()
+        self.created = 0
+        self.reused = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @plotting
+    def acquire(self, nrows=1, ncols=1, figsize=(20, 10), **kwargs) -> Tuple[Figure, object]:
+        '''
+        Returns figure from the pool (or a new one) with a grid of subplots, same as plt.subplots.
+
+        Prameters:
+          nrows, ncols: int, default 1
+            Subplots grid size.
+          figsize: Tuple[int, int], default (20, 10)
+            Figure size in inches.
+          **kwargs:
+            Passed to Figure.subplots (sharex, sharey, squeeze, ...).
+
+        Returns:
+          fig: Figure
+            Figure, which must be returned with release, or acquired inside scope.
+          axs: plt.Axes or array of plt.Axes
+            Subplots of the figure.
+        '''
+
+        with self.lock:
+            fig = self.pool.pop() if self.pool else None
+
+            if fig is None:
+                self.created += 1
+            else:
+                self.reused += 1
+
+        if fig is None:
+            fig = Figure()
+            FigureCanvasAgg(fig)
+
+        # a preview may have lowered the dpi of a pooled figure (see RenderService.save_figure)
+        fig.set_dpi(plt.rcParams['figure.dpi'])
+        fig.set_size_inches(figsize)
+        axs = fig.subplots(nrows=nrows, ncols=ncols, **kwargs)
+
+        with self.lock:
+            self.live.add(fig)
+
+        scopes = getattr(self.local, 'scopes', None)
+
+        if scopes:
+            scopes[-1].append(fig)
+
+        return fig, axs
+
+    def release(self, fig: Figure):
+        '''
+        Clears the figure and returns it to the pool. Releasing a figure twice does nothing.
+        '''
+
+        with self.lock:
+            if fig not in self.live:
+                return
+
+            self.live.discard(fig)
+
+        fig.clear()
+
+        with self.lock:
+            if len(self.pool) < self.pool_size:
+                self.pool.append(fig)
+
+    @contextmanager
+    def scope(self):
+        '''
+        Releases all figures acquired by the current thread inside the with block, even if drawing failed.
+        '''
+
+        if not hasattr(self.local, 'scopes'):
+            self.local.scopes = []
+
+        self.local.scopes.append([])
+
+        try:
+            yield self
+        finally:
+            for fig in self.local.scopes.pop():
+                self.release(fig)
+
+    def live_count(self) -> int:
+        '''
+        Number of acquired and not yet released figures, stays 0 between renders if nothing leaks.
+        '''
+
+        with self.lock:
+            return len(self.live)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'live': len(self.live), 'pooled': len(self.pool), 'created': self.created, 'reused': self.reused}
+
 
 class GraphVisualizer:
     '''
       Common data visaulize helper for group project of team #8.
     '''
 
-    def __init__(self, alpha=1.0, colors=sns.color_palette('pastel')):
+    # figures are shared by all visualizers of the process and are not pickled with them
+    figures = FigureManager()
+
+    def __init__(self, alpha=1.0, colors=None):
         '''
         Initialize the visualizer.
 
         Prameters:
           alpha: float, default 1.0
             Custom plots alpha value, alpha must be within the 0-1 range, inclusive.
-          colors: TODO, default sns.color_palette('pastel')
-            List of colors or continuous colormap defining a palette.
+          colors: TODO, default None
+            List of colors or continuous colormap defining a palette, None means sns.color_palette('pastel').
         '''
 
         self.alpha = alpha
         self.colors = colors
 
+    def close(self, fig: Figure):
+        '''
+        Releases figure returned by make_* methods, if it was not created inside figures.scope().
+        '''
+
+        self.figures.release(fig)
+
+    def _get_colors(self):
+        return self.colors if self.colors is not None else default_colors
+
+    @plotting
     def make_bar_plot(self,
                       data: pd.DataFrame = None, figsize=(20, 10), ax: plt.Axes = None, **kwargs) -> Optional[
         plt.Figure]:
@@ -72,11 +260,14 @@ class GraphVisualizer:
         ax: plt.Axes = ax
 
         if ax is None:
-            fig, ax = plt.subplots(figsize=figsize)
+            fig, ax = self.figures.acquire(figsize=figsize)
         else:
             ax = ax
 
-        sns.barplot(data=data, x=data.get('x', None), y=data.get('y', None), ax=ax, alpha=self.alpha)
+        if self._is_aggregated(data):
+            self._draw_bars(ax, data)
+        else:
+            sns.barplot(data=data, x=data.get('x', None), y=data.get('y', None), ax=ax, alpha=self.alpha)
 
         self._configure_axes(
             ax,
@@ -87,6 +278,7 @@ class GraphVisualizer:
 
         return fig
 
+    @plotting
     def make_bar_multiplot(self,
                            data: List[pd.DataFrame], title: StrOrStrList = None,
                            xlabel: StrOrStrList = None, ylabel: StrOrStrList = None,
@@ -129,7 +321,7 @@ class GraphVisualizer:
         nrows = 1 if direction == 'row' else len(data)
         ncols = 1 if direction == 'col' else len(data)
 
-        fig, axs = plt.subplots(nrows=nrows, ncols=ncols, figsize=figsize, sharex=sharex, sharey=sharey)
+        fig, axs = self.figures.acquire(nrows=nrows, ncols=ncols, figsize=figsize, sharex=sharex, sharey=sharey)
 
         for (i, graph_data) in enumerate(data):
             item_title = title[i] if type(title) is list else title
@@ -151,10 +343,86 @@ class GraphVisualizer:
 
         return fig
 
+    @plotting
+    def make_graph(self, data: pd.DataFrame, config: dict, ax: plt.Axes = None) -> Optional[plt.Figure]:
+        '''
+        Draws graph described by configurator config from prepared data (see DataFrameContainer.make_data).
+
+        Prameters:
+          data: pd.DataFrame
+            Prepared graph data with x/y columns.
+          config: dict
+            Graph config with graph_type ('bar', 'scatter', 'hist' or 'pie'), graph_title and plot options.
+          ax: Optional[plt.Axes], default None
+            Axes object to draw the graph onto, otherwise generates own figure.
+
+        Returns:
+          fig: Optional[plt.Figure]
+            Returns pyplot figure if axes was not passed, otherwise None.
+        '''
+
+        graph_type = config['graph_type']
+        title = config.get('graph_title', None)
+
+        if graph_type == 'bar':
+            return self.make_bar_plot(data, title=title, ax=ax, **config)
+        elif graph_type == 'scatter':
+            return self.make_scatter_plot(data, title=title, ax=ax, **config)
+        elif graph_type == 'hist':
+            return self.make_hist_plot(data, title=title, ax=ax, **config)
+        elif graph_type == 'pie':
+            return self.make_pie_chart(data['y'], labels=data['x'], title=title, ax=ax, **config)
+
+    @plotting
+    def make_dashboard(self,
+                       data: List[pd.DataFrame], configs: List[dict], ncols=2, panel_size=(10, 6),
+                       title: str = None, title_size=20) -> plt.Figure:
+        '''
+        Shows several graphs of any type as panels of a single figure.
+
+        Prameters:
+          data: List[pd.DataFrame]
+            Prepared data for each panel.
+          configs: List[dict]
+            Graph config for each panel (see make_graph).
+          ncols: int, default 2
+            Max number of panels in a row.
+          panel_size: Tuple[int, int], default (10, 6)
+            Size of a single panel, figure size is computed from the grid.
+          title: Optional[str], default None
+            Figure title text.
+          title_size: int, default 20
+            Figure title font size.
+
+        Returns:
+          fig: plt.Figure
+            Returns pyplot figure.
+        '''
+
+        ncols = max(1, min(ncols, len(data)))
+        nrows = (len(data) + ncols - 1) // ncols
+
+        figsize = (panel_size[0] * ncols, panel_size[1] * nrows)
+        fig, axs = self.figures.acquire(nrows=nrows, ncols=ncols, figsize=figsize, squeeze=False)
+
+        for (i, ax) in enumerate(axs.flat):
+            if i < len(data):
+                self.make_graph(data[i], configs[i], ax=ax)
+            else:
+                ax.set_visible(False)
+
+        if title is not None:
+            fig.suptitle(title, fontsize=title_size)
+
+        fig.tight_layout()
+
+        return fig
+
+    @plotting
     def make_pie_chart(self,
                        data: pd.DataFrame, title: str = None, labels: List[str] = None,
                        title_size=16, label_size=14, figsize=(10, 10),
-                       autopct='%1.0f%%', **kwargs) -> plt.Figure:
+                       autopct='%1.0f%%', ax: plt.Axes = None, **kwargs) -> Optional[plt.Figure]:
         '''
         Shows pie chart plot with plt.pie.
 
@@ -175,15 +443,20 @@ class GraphVisualizer:
             If not None, is a string or function used to label the wedges with their numeric value.
             The label will be placed inside the wedge. If it is a format string, the label will be fmt % pct.
             If it is a function, it will be called.
+          ax: Optional[plt.Axes], default None
+            Axes object to draw the chart onto, otherwise generates own Axes.
 
         Returns:
-          fig: plt.Figure
-            Returns pyplot figure.
+          fig: Optional[plt.Figure]
+            Returns pyplot figure if axes was not passed, otherwise None.
         '''
 
-        fig, ax = plt.subplots(figsize=figsize)
+        fig: plt.Figure = None
+
+        if ax is None:
+            fig, ax = self.figures.acquire(figsize=figsize)
 
-        ax.pie(data, labels=labels, autopct=autopct, colors=self.colors, textprops={'fontsize': label_size})
+        ax.pie(data, labels=labels, autopct=autopct, colors=self._get_colors(), textprops={'fontsize': label_size})
 
         ax.set_alpha(self.alpha)
 
@@ -192,11 +465,14 @@ class GraphVisualizer:
 
         return fig
 
+    @plotting
     def make_scatter_plot(self,
                           data: pd.DataFrame = None, figsize=(20, 10),
-                          alpha: float = None, **kwargs) -> plt.Figure:
+                          alpha: float = None, scatter_mode: Literal['auto', 'points', 'density', 'sample'] = 'auto',
+                          point_budget: int = 50000, density_bins=200, ax: plt.Axes = None,
+                          **kwargs) -> Optional[plt.Figure]:
         '''
-        Shows scatter plot with sns.scatterplot.
+        Shows scatter plot with sns.scatterplot or density raster for large datasets.
 
         Prameters:
           data: Optional[pd.DataFrame], default None
@@ -213,6 +489,16 @@ class GraphVisualizer:
             Plot axis labels font size.
           alpha: float, default GraphVisualizer instance alpha property
             Custom plot dots alpha value.
+          scatter_mode: Literal['auto', 'points', 'density', 'sample'], default 'auto'
+            'points' and 'sample' draw every passed point (data is expected to be sampled beforehand for 'sample'),
+            'density' draws 2D histogram raster computed with NumPy,
+            'auto' draws density raster if there are more than point_budget points.
+          point_budget: int, default 50000
+            Max number of points drawn one by one in 'auto' mode.
+          density_bins: int, default 200
+            Number of density raster bins along each axis.
+          ax: Optional[plt.Axes], default None
+            Axes object to draw the plot onto, otherwise generates own Axes.
           x_logscale, y_logscale: bool
             If True axis scale type equals 'log', default False.
           xticks, yticks: Optional[List[str]], default None
@@ -223,16 +509,27 @@ class GraphVisualizer:
             Plot axis ticks roatation angle.
 
         Returns:
-          fig: plt.Figure
-            Returns pyplot figure.
+          fig: Optional[plt.Figure]
+            Returns pyplot figure if axes was not passed, otherwise None.
         '''
 
-        fig, ax = plt.subplots(figsize=figsize)
+        fig: plt.Figure = None
+
+        if ax is None:
+            fig, ax = self.figures.acquire(figsize=figsize)
 
         if alpha is None:
             alpha = self.alpha
 
-        sns.scatterplot(data=data, x=data.get('x', None), y=data.get('y', None), ax=ax, alpha=alpha)
+        if point_budget is None:
+            point_budget = 50000
+
+        use_density = scatter_mode == 'density' or (scatter_mode == 'auto' and len(data) > point_budget)
+
+        if use_density and self._is_numeric(data.get('x', None)) and self._is_numeric(data.get('y', None)):
+            self._draw_density(ax.figure, ax, data['x'], data['y'], density_bins)
+        else:
+            sns.scatterplot(data=data, x=data.get('x', None), y=data.get('y', None), ax=ax, alpha=alpha)
 
         self._configure_axes(
             ax,
@@ -243,17 +540,105 @@ class GraphVisualizer:
 
         return fig
 
+    def _draw_density(self, fig: plt.Figure, ax: plt.Axes, data_x: pd.Series, data_y: pd.Series, bins=200):
+        '''
+        Draws 2D histogram of points as a single raster image, render time does not depend on points count.
+
+        Prameters:
+          fig: plt.Figure
+            Figure to place colorbar onto.
+          ax: plt.Axes
+            Axes object to draw the raster onto.
+          data_x, data_y: pd.Series
+            Numeric points coordinates.
+          bins: int, default 200
+            Number of bins along each axis.
+
+        Returns: None.
+        '''
+
+        x = data_x.to_numpy(dtype=float, na_value=np.nan)
+        y = data_y.to_numpy(dtype=float, na_value=np.nan)
+        mask = ~(np.isnan(x) | np.isnan(y))
+
+        counts, xedges, yedges = np.histogram2d(x[mask], y[mask], bins=bins)
+        counts = np.ma.masked_equal(counts, 0)
+
+        image = ax.imshow(counts.T, origin='lower', aspect='auto', interpolation='nearest',
+                          extent=(xedges[0], xedges[-1], yedges[0], yedges[-1]),
+                          cmap='viridis', norm=LogNorm(vmin=1, vmax=counts.max() if counts.count() else 1))
+        fig.colorbar(image, ax=ax)
+
+    def _is_aggregated(self, data: pd.DataFrame) -> bool:
+        '''
+        Checks if bar data has exactly one row per category, so it can be drawn without seaborn estimator.
+        '''
+
+        if 'x' not in data or 'y' not in data:
+            return False
+
+        category = 'y' if self._is_numeric(data['x']) and not self._is_numeric(data['y']) else 'x'
+
+        return data[category].is_unique
+
+    def _draw_bars(self, ax: plt.Axes, data: pd.DataFrame):
+        '''
+        Draws already aggregated bars with a single vectorized ax.bar/ax.barh call.
+
+        Prameters:
+          ax: plt.Axes
+            Axes object to draw the bars onto.
+          data: pd.DataFrame
+            Dataset with one row per category: x/y columns and optional err column with error bar sizes.
+            Bars are horizontal if x is numeric and y is not, as in sns.barplot.
+
+        Returns: None.
+        '''
+
+        horizontal = self._is_numeric(data['x']) and not self._is_numeric(data['y'])
+        category, value = ('y', 'x') if horizontal else ('x', 'y')
+        positions = np.arange(len(data))
+        palette_colors = self._get_colors()
+        colors = [palette_colors[i % len(palette_colors)] for i in range(len(data))]
+        err = data['err'].to_numpy() if 'err' in data else None
+        labels = [str(label) for label in data[category]]
+
+        if horizontal:
+            ax.barh(positions, data[value].to_numpy(), height=0.8, xerr=err, color=colors, alpha=self.alpha)
+            ax.set_yticks(positions)
+            ax.set_yticklabels(labels)
+            ax.set_ylim(len(data) - 0.5, -0.5)
+        else:
+            ax.bar(positions, data[value].to_numpy(), width=0.8, yerr=err, color=colors, alpha=self.alpha)
+            ax.set_xticks(positions)
+            ax.set_xticklabels(labels)
+            ax.set_xlim(-0.5, len(data) - 0.5)
+
+        ax.set_xlabel('x')
+        ax.set_ylabel('y')
+
+    def _is_numeric(self, data: pd.Series = None) -> bool:
+        return data is not None and is_numeric_dtype(data.dtype) and not is_bool_dtype(data.dtype)
+
+    @plotting
     def make_hist_plot(self,
                        data: pd.DataFrame = None, figsize=(20, 10),
-                       bins=10, discrete=False, **kwargs) -> plt.Figure:
+                       bins=10, discrete=False, ax: plt.Axes = None, **kwargs) -> Optional[plt.Figure]:
         '''
-        Shows histogram plot with sns.histplot.
+        Shows histogram plot. Pre-binned data (x/width/y columns, see DataFrameContainer.hist_bins)
+        is drawn directly with a single ax.bar call, raw x/y data is passed to sns.histplot.
 
         Prameters:
           data: Optional[pd.DataFrame], default None
-            Dataset for plotting with x/y columns.
+            Dataset for plotting with x/y columns or pre-binned x (bin left edge), width and y (count) columns.
           figsize: Tuple[int, int], default (20, 10)
             Plot figsize.
+          bins: int, default 10
+            Number of bins for raw data.
+          discrete: bool, default False
+            If True each integer gets its own bin for raw data.
+          ax: Optional[plt.Axes], default None
+            Axes object to draw the plot onto, otherwise generates own Axes.
           title: Optional[str], default None
             Plot title text.
           xlabel, ylabel: Optional[str], default None
@@ -274,14 +659,21 @@ class GraphVisualizer:
             Plot axis ticks roatation angle.
 
         Returns:
-          fig: plt.Figure
-            Returns pyplot figure.
+          fig: Optional[plt.Figure]
+            Returns pyplot figure if axes was not passed, otherwise None.
         '''
 
-        fig, ax = plt.subplots(figsize=figsize)
+        fig: plt.Figure = None
 
-        sns.histplot(data=data, x=data.get('x', None), y=data.get('y', None), ax=ax, bins=bins, discrete=discrete,
-                     alpha=self.alpha)
+        if ax is None:
+            fig, ax = self.figures.acquire(figsize=figsize)
+
+        if 'width' in data:
+            ax.bar(data['x'], data['y'], width=data['width'], align='edge' if self._is_numeric(data['x']) else 'center',
+                   color=self._get_colors()[0], edgecolor='white', alpha=self.alpha)
+        else:
+            sns.histplot(data=data, x=data.get('x', None), y=data.get('y', None), ax=ax, bins=bins, discrete=discrete,
+                         alpha=self.alpha)
 
         self._configure_axes(
             ax,
@@ -0,0 +1,111 @@
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+import threading
+import sys
+
+
+def sizeof(value: Any) -> int:
+    ''' Размер значения в байтах, для датафреймов с учетом содержимого строк '''
+    # pandas не импортируется ради проверки: если он еще не загружен, датафреймов в кэше нет
+    pd = sys.modules.get('pandas', None)
+
+    if pd is not None and isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+
+    if pd is not None and isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    ''' Потокобезопасный LRU кэш с ограничением по суммарному размеру значений в байтах.
+
+    Значения, которые больше всего кэша, не сохраняются. Считает попадания, промахи и вытеснения. '''
+
+    def __init__(self, max_bytes: int = 256 << 20, sizeof: Callable[[Any], int] = sizeof):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.items = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self.lock:
+            return key in self.items
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def get(self, key: Hashable, default=None):
+        with self.lock:
+            if key not in self.items:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self.items.move_to_end(key)
+
+            return self.items[key][0]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        size = self.sizeof(value)
+
+        with self.lock:
+            self.pop(key)
+
+            if size > self.max_bytes:
+                return
+
+            self.items[key] = (value, size)
+            self.current_bytes += size
+
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self.items.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]):
+        ''' Значение из кэша или результат compute(), который сразу кладется в кэш '''
+        with self.lock:
+            if key in self.items:
+                return self.get(key)
+
+            self.misses += 1
+
+        value = compute()
+        self.put(key, value)
+
+        return value
+
+    def pop(self, key: Hashable, default=None):
+        with self.lock:
+            if key not in self.items:
+                return default
+
+            value, size = self.items.pop(key)
+            self.current_bytes -= size
+
+            return value
+
+    def clear(self) -> None:
+        with self.lock:
+            self.items.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'items': len(self.items),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Hashable, List
+import multiprocessing
+import threading
+import time
+import io
+
+from GraphVisualizer import GraphVisualizer, load_plotting
+
+# pandas нужен только для аннотаций, данные графиков приходят уже готовыми датафреймами
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+# профили качества картинки: превью на страницах настройки графика и итоговая картинка по кнопке "Готово".
+# превью меньше за счет dpi (размеры фигуры и шрифтов в дюймах те же, поэтому компоновка совпадает с итоговой),
+# сохраняется как png с палитрой из colors цветов (для графиков из заливок в несколько раз меньше jpeg),
+# а облако точек раньше переходит в растр плотности. plot - параметры отрисовки поверх конфига графика.
+render_profiles = {
+    'preview': {
+        'dpi': 40,
+        'colors': 64,
+        'plot': {'point_budget': 5000, 'density_bins': 100}
+    },
+    'final': {
+        'dpi': None,
+        'colors': None,
+        'plot': {}
+    }
+}
+
+
+def render_graph(visualizer: GraphVisualizer, data: pd.DataFrame, config: dict, profile: str = 'final') -> bytes:
+    ''' Рисует график по готовым данным и конфигу, возвращает картинку в байтах. Выполняется в процессе-воркере. '''
+    with visualizer.figures.scope():
+        return save_figure(visualizer.make_graph(data, dict(config, **render_profiles[profile]['plot'])), profile)
+
+
+def render_dashboard(visualizer: GraphVisualizer, data: List[pd.DataFrame], configs: List[dict]) -> bytes:
+    ''' Рисует несколько графиков панелями одной картинки (один savefig на весь дашборд) '''
+    with visualizer.figures.scope():
+        return save_figure(visualizer.make_dashboard(data, configs))
+
+
+def warm_up() -> float:
+    ''' Прогрев процесса-воркера: импорт matplotlib, seaborn и pandas, стиль, кэш шрифтов и первая отрисовка.
+     Возвращает время прогрева в секундах. '''
+    started = time.perf_counter()
+
+    load_plotting()
+
+    import pandas as pd
+
+    data = pd.DataFrame({'x': ['a', 'b'], 'y': [1.0, 2.0]})
+    render_graph(GraphVisualizer(), data, {'graph_type': 'bar', 'graph_title': 'warm up'}, 'preview')
+
+    return time.perf_counter() - started
+
+
+def save_figure(figure, profile: str = 'final') -> bytes:
+    ''' Сохраняет фигуру в байты. Фигуру освобождает scope менеджера фигур, в котором она нарисована. '''
+    photo = io.BytesIO()
+    options = render_profiles[profile]
+
+    if options['colors'] is None:
+        figure.savefig(photo, format='png', dpi=options['dpi'] or 'figure')
+
+        return photo.getvalue()
+
+    # палитра строится прямо по отрисованному буферу холста, png кодируется один раз
+    from PIL import Image
+
+    if options['dpi'] is not None:
+        figure.set_dpi(options['dpi'])
+
+    figure.canvas.draw()
+    image = Image.frombuffer('RGBA', figure.canvas.get_width_height(), figure.canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1)
+    image.convert('RGB').quantize(options['colors'], method=Image.Quantize.FASTOCTREE).save(photo, format='png')
+
+    return photo.getvalue()
+
+
+class RenderService:
+    ''' Отрисовка графиков вне потоков обработчиков бота.
+
+    Данные графика считаются в своем пуле потоков (пайплайн и кэши контейнера общие для процесса),
+    картинка рисуется в пуле процессов: pyplot не потокобезопасен, и долгая отрисовка одного
+    пользователя не должна задерживать остальных. Пулы размеряются отдельно: подготовка данных
+    в основном ждет чтения файлов и pandas, отрисовка ограничена числом процессов.
+
+    Для каждого пользователя актуальна только последняя задача: новая задача отменяет предыдущую,
+    если та еще не начата, уже начатая устаревшая задача останавливается между стадиями пайплайна,
+    а результат отрисовки устаревшей задачи отбрасывается. '''
+
+    def __init__(self, workers: int = 2, data_workers: int = 8):
+        self.workers = workers
+        # spawn, а не fork: процесс бота многопоточный
+        self.process_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        self.data_pool = ThreadPoolExecutor(max_workers=data_workers, thread_name_prefix='render-data')
+        self.jobs = dict()
+        self.generations = dict()
+        self.lock = threading.Lock()
+
+    def render(self, visualizer: GraphVisualizer, data: pd.DataFrame, config: dict, profile: str = 'final') -> bytes:
+        ''' Синхронная отрисовка в пуле процессов '''
+        return self.process_pool.submit(render_graph, visualizer, data, config, profile).result()
+
+    def render_dashboard(self, visualizer: GraphVisualizer, data: List[pd.DataFrame], configs: List[dict]) -> bytes:
+        ''' Синхронная отрисовка дашборда в пуле процессов '''
+        return self.process_pool.submit(render_dashboard, visualizer, data, configs).result()
+
+    def warm_up(self) -> List[float]:
+        ''' Запускает процессы пула и прогревает каждый, чтобы первый график не ждал импорт библиотек.
+         Возвращает время прогрева каждого воркера. '''
+        futures = [self.process_pool.submit(warm_up) for _ in range(self.workers)]
+
+        return [future.result() for future in futures]
+
+    def submit(self, owner: Hashable, make_data: Callable[[Callable[[], bool]], pd.DataFrame],
+               visualizer: GraphVisualizer, config: dict, on_done: Callable[[bytes], Any],
+               on_error: Callable[[Exception], Any] = None, profile: str = 'final') -> Future:
+        ''' Ставит задачу отрисовки для owner (пользователя), отменяя его предыдущую задачу.
+        make_data(cancelled) получает функцию, которая возвращает True, когда задача устарела.
+        on_done(картинка) и on_error(err) вызываются в потоке пула, только если задача все еще последняя. '''
+        with self.lock:
+            generation = self.generations.get(owner, 0) + 1
+            self.generations[owner] = generation
+
+            previous = self.jobs.get(owner, None)
+            future = self.data_pool.submit(self.run_job, owner, generation, make_data, visualizer, dict(config),
+                                             on_done, on_error, profile)
+            self.jobs[owner] = future
+
+        # отмена вызывает done callback синхронно, поэтому вне блокировки
+        if previous is not None:
+            previous.cancel()
+
+        future.add_done_callback(lambda done: self.forget(owner, done))
+
+        return future
+
+    def run_job(self, owner: Hashable, generation: int, make_data: Callable[[Callable[[], bool]], pd.DataFrame],
+                visualizer: GraphVisualizer, config: dict, on_done: Callable[[bytes], Any],
+                on_error: Callable[[Exception], Any], profile: str = 'final') -> None:
+        try:
+            data = make_data(lambda: self.is_stale(owner, generation))
+
+            if self.is_stale(owner, generation):
+                return
+
+            photo = self.render(visualizer, data, config, profile)
+
+            if not self.is_stale(owner, generation):
+                on_done(photo)
+        except Exception as err:
+            if on_error is not None and not self.is_stale(owner, generation):
+                on_error(err)
+
+    def is_stale(self, owner: Hashable, generation: int) -> bool:
+        with self.lock:
+            return self.generations.get(owner, 0) != generation
+
+    def forget(self, owner: Hashable, future: Future) -> None:
+        with self.lock:
+            if self.jobs.get(owner, None) is future:
+                del self.jobs[owner]
+
+    def cancel(self, owner: Hashable) -> None:
+        ''' Отменяет текущую задачу owner, результат уже начатой задачи будет отброшен '''
+        with self.lock:
+            self.generations[owner] = self.generations.get(owner, 0) + 1
+            previous = self.jobs.pop(owner, None)
+
+        if previous is not None:
+            previous.cancel()
+
+    def wait(self, owner: Hashable, timeout: float = None) -> None:
+        ''' Ждет завершения текущей задачи owner (вместе с on_done) '''
+        with self.lock:
+            future = self.jobs.get(owner, None)
+
+        if future is not None:
+            try:
+                future.result(timeout)
+            except Exception:
+                pass
+
+    def shutdown(self) -> None:
+        self.data_pool.shutdown(wait=False, cancel_futures=True)
+        self.process_pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Callable, Hashable
+import threading
+import time
+
+# только для аннотаций: модуль с pandas не загружается при старте бота
+if TYPE_CHECKING:
+    from DataFrameContainer import DataFrameContainer
+
+
+class SessionManager:
+    ''' Учет датафреймов пользовательских сессий с общим бюджетом памяти.
+
+    Каждое обращение пользователя (touch) делает его сессию самой свежей. Если суммарный объем загруженных
+    колонок (deep memory usage) больше max_bytes, выгружаются датафреймы давно неактивных сессий,
+    а сессии, простаивающие дольше ttl секунд, выгружаются всегда. Выгружается только frame контейнера
+    (DataFrameContainer.release): конфигуратор, профиль колонок и кэши остаются, колонки подгружаются
+    заново при следующем обращении к данным. '''
+
+    def __init__(self, max_bytes: int = 2 << 30, ttl: float = 30 * 60, clock: Callable[[], float] = time.monotonic,
+                 log: Callable[[int, str, Any], None] = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.log = log
+        # user_id -> (контейнер, время последнего обращения), от давних к свежим
+        self.sessions = OrderedDict()
+        self.evictions = 0
+        self.freed_bytes = 0
+        self.lock = threading.RLock()
+        self.stop_event = threading.Event()
+
+    def touch(self, user_id: Hashable, container: DataFrameContainer) -> None:
+        ''' Отмечает обращение пользователя и при необходимости выгружает чужие датафреймы '''
+        if container is None:
+            self.remove(user_id)
+            return
+
+        with self.lock:
+            self.sessions[user_id] = (container, self.clock())
+            self.sessions.move_to_end(user_id)
+
+        self.enforce(keep=user_id)
+
+    def remove(self, user_id: Hashable) -> None:
+        with self.lock:
+            self.sessions.pop(user_id, None)
+
+    # контейнеры вызываются только вне self.lock: обращения других пользователей (touch) не ждут замеров и выгрузки
+    def memory_usage(self) -> dict:
+        with self.lock:
+            sessions = list(self.sessions.items())
+
+        return {user_id: container.memory_usage() for user_id, (container, _) in sessions}
+
+    def enforce(self, keep: Hashable = None) -> None:
+        ''' Выгружает сессии с истекшим ttl, затем самые давние, пока не уложимся в бюджет.
+         Сессия keep (текущий пользователь) не выгружается. '''
+        with self.lock:
+            now = self.clock()
+            sessions = list(self.sessions.items())
+
+        usage = {user_id: container.memory_usage() for user_id, (container, _) in sessions}
+        total = sum(usage.values())
+
+        for user_id, (container, last_access) in sessions:
+            if user_id == keep or usage[user_id] == 0:
+                continue
+
+            if now - last_access < self.ttl and total <= self.max_bytes:
+                # дальше сессии только свежее
+                break
+
+            with self.lock:
+                # пользователь мог обратиться снова, пока считалась память
+                if self.sessions.get(user_id, (None, None))[1] != last_access:
+                    continue
+
+            total -= self.release(user_id, container)
+
+    def release(self, user_id: Hashable, container: DataFrameContainer) -> int:
+        freed = container.release()
+
+        with self.lock:
+            self.evictions += 1
+            self.freed_bytes += freed
+
+        if self.log is not None:
+            self.log(user_id, 'SessionManager.release', f'freed {freed} bytes')
+
+        return freed
+
+    def stats(self) -> dict:
+        usage = self.memory_usage()
+
+        with self.lock:
+            return {
+                'sessions': len(usage),
+                'bytes': sum(usage.values()),
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions,
+                'freed_bytes': self.freed_bytes
+            }
+
+    def start(self, interval: float = 60) -> threading.Thread:
+        ''' Фоновая проверка ttl раз в interval секунд, чтобы неактивные сессии выгружались без новых сообщений '''
+
+        def run():
+            while not self.stop_event.wait(interval):
+                try:
+                    self.enforce()
+                except Exception as err:
+                    if self.log is not None:
+                        self.log(-1, 'SessionManager.enforce', err)
+
+        thread = threading.Thread(target=run, name='session-manager', daemon=True)
+        thread.start()
+
+        return thread
+
+    def stop(self) -> None:
+        self.stop_event.set()
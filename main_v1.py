@@ -1,21 +1,62 @@
+import time
+
+# от запуска процесса считаются время импорта и время до первого ответа (см. Main.startup)
+process_started = time.perf_counter()
+
+# при старте импортируются только легкие модули: matplotlib и seaborn загружаются в GraphVisualizer
+# при первой отрисовке, pandas и модули данных (DataFrameContainer, FrameRegistry) - фоновым прогревом
 from GraphVisualizer import GraphVisualizer
-from DataFrameContainer import DataFrameContainer
 from Configurator import ConcreteConfigurator
+from LRUCache import LRUCache
+from RenderService import RenderService
+from AsyncRuntime import AsyncBotRuntime
+from SessionManager import SessionManager
+from Downloader import DownloadError, StreamingDownloader
+from collections import defaultdict
 from typing import Any
 
 # Инициализация бота
-import telebot, os, json, requests, datetime
+import telebot, os, json, hashlib, datetime, threading
 from telebot.types import KeyboardButton, ReplyKeyboardRemove
 
 from tg_token import token
 
+imports_finished = time.perf_counter()
+
 
 
 class Main:
     def __init__(self, token: str) -> None:
+        # замеры запуска в секундах, пишутся в лог после прогрева и после первого ответа
+        self.startup = {'imports': imports_finished - process_started, 'init': None, 'data_modules': None,
+                        'render_workers': None, 'warm_up': None, 'first_response': None,
+                        'first_response_handling': None}
         self.tg_token = token
-        self.tg_bot = telebot.TeleBot(token)
+        # запросы к Telegram асинхронные, обработчики работают с синхронным фасадом в пуле потоков
+        self.runtime = AsyncBotRuntime(token, log=self.log_w)
+        self.tg_bot = self.runtime.bot
         self.tg_users = {}
+        # общий для всех пользователей кэш готовых данных графиков
+        self.result_cache = LRUCache(max_bytes=256 << 20)
+        # файлы больше этого размера считаются потоково, блоками
+        self.memory_limit = 1 << 30
+        # общий кэш промежуточных результатов стадий пайплайнов
+        self.stage_cache = LRUCache(max_bytes=512 << 20)
+        # кэш готовых картинок графиков
+        self.render_cache = LRUCache(max_bytes=64 << 20)
+        # графики рисуются в отдельных процессах, обработчики бота не ждут отрисовку
+        self.render_service = RenderService(workers=int(os.environ.get('RENDER_WORKERS', 2)),
+                                            data_workers=int(os.environ.get('DATA_WORKERS', 8)))
+        # сообщения пользователя меняются и из обработчиков, и из потоков отрисовки
+        self.user_locks = defaultdict(threading.RLock)
+        # общий бюджет памяти на датафреймы пользователей, неактивные сессии выгружаются
+        self.sessions = SessionManager(max_bytes=2 << 30, ttl=30 * 60, log=self.log_w)
+        # одинаковые файлы разных пользователей разбираются один раз и хранятся в памяти в одном экземпляре.
+        # создается фоновым прогревом вместе с импортом pandas, готовность - data_ready
+        self.frame_registry = None
+        self.data_ready = threading.Event()
+        # скачивание файлов по ссылкам: потоково на диск, с ограничением размера и таймаутами
+        self.downloader = StreamingDownloader(max_bytes=2 << 30)
         self.main_dir = os.getcwd() + '/data/'
 
         try:
@@ -23,6 +64,62 @@ class Main:
         except Exception as err:
             self.log_w(-1, '__init__',  err)
 
+        self.startup['init'] = time.perf_counter() - imports_finished
+
+    def warm_up(self) -> None:
+        ''' Фоновый прогрев после старта: бот уже отвечает на /start, а в это время импортируются pandas
+         и модули данных, запускаются процессы отрисовки (matplotlib, seaborn, шрифты, первый график). '''
+
+        started = time.perf_counter()
+
+        try:
+            import pandas as pd
+
+            # общие датафреймы (FrameRegistry) отдают контейнерам колонки без копирования, поэтому изменение
+            # производного датафрейма не должно менять исходные данные: в pandas 3 copy-on-write включен всегда
+            if int(pd.__version__.split('.')[0]) < 3:
+                pd.set_option('mode.copy_on_write', True)
+
+            from FrameRegistry import FrameRegistry
+            import DataFrameContainer
+
+            self.frame_registry = FrameRegistry()
+            self.startup['data_modules'] = time.perf_counter() - started
+        except Exception as err:
+            self.log_w(-1, 'warm_up', err)
+        finally:
+            self.data_ready.set()
+
+        try:
+            self.startup['render_workers'] = self.render_service.warm_up()
+        except Exception as err:
+            self.log_w(-1, 'warm_up', err)
+
+        self.startup['warm_up'] = time.perf_counter() - started
+        self.log_w(-1, 'warm_up', self.startup_report())
+
+    def startup_report(self) -> str:
+        ''' Замеры запуска: импорт, инициализация, прогрев (модули данных и каждый процесс отрисовки)
+         и первый ответ (от запуска процесса и от получения сообщения) '''
+
+        def format_value(value):
+            if value is None:
+                return '-'
+            if type(value) is list:
+                return '[' + ', '.join(format_value(item) for item in value) + ']'
+
+            return f'{value:.3f}s'
+
+        return ', '.join(f'{key}: {format_value(value)}' for key, value in self.startup.items())
+
+    def check_csv(self, sample: bytes):
+        ''' Проверка начала файла (DataFrameContainer.check_csv). Модуль импортируется здесь, а не при старте:
+         если прогрев еще не закончился, импорт дождется его. '''
+
+        from DataFrameContainer import DataFrameContainer
+
+        return DataFrameContainer.check_csv(sample)
+
     def log_w(self, user_id: int, function: str, txt: Any) -> None:
         ''' Фукнкция записи логов '''
         msg = f'{str(datetime.datetime.now())}, {function}, {user_id}: {txt}\n'
@@ -105,105 +202,296 @@ class Main:
                                  )
 
     def show_menu(self, user_id: int) -> None:
-        ''' Создает сообщение с кнопками меню, обноляет сообщение.  '''
+        ''' Создает сообщение с кнопками меню, обноляет сообщение. Если превью графика еще нет в кэше,
+         оно заказывается у сервиса отрисовки и появится над меню, когда будет готово. '''
 
-        bot = self.tg_bot
+        with self.user_locks[user_id]:
+            bot = self.tg_bot
+
+            users = self.tg_users
+            configurator = users[user_id]['configurator']
+            current_menu_page = configurator.current_menu_page
+            text = current_menu_page['title'] + ':'
+            reply_markup = self.generate_buttons(current_menu_page.get('items', []), current_menu_page.get('layout', []))
+
+            if users[user_id].get('loading_message', None) is not None:
+                bot.delete_message(user_id, users[user_id]['loading_message'].message_id)
+                users[user_id]['loading_message'] = None
+
+            if users[user_id].get('error_message', None) is not None:
+                bot.delete_message(user_id, users[user_id]['error_message'].message_id)
+                users[user_id]['error_message'] = None
+
+            if current_menu_page.get('show_graph', None) is not None:
+                photo = self.render_cache.get(self.make_graph_key(user_id, 'preview'))
+
+                if photo is not None:
+                    # начатая задача для прежнего конфига не должна заменить эту картинку своей
+                    self.render_service.cancel(user_id)
+                    self.update_photo(user_id, photo)
+                else:
+                    self.submit_graph(user_id)
+            else:
+                self.render_service.cancel(user_id)
+
+                if users[user_id]['last_photo_message']:
+                    bot.delete_message(user_id, users[user_id]['last_photo_message'].message_id)
+                    users[user_id]['last_photo_message'] = None
 
+            last_message = users[user_id]['last_message']
+
+            if last_message is not None:
+                bot.edit_message_text(text, user_id, last_message.message_id, reply_markup=reply_markup)
+            else:
+                last_message = bot.send_message(user_id, text, reply_markup=reply_markup)
+
+            configurator_wait_input = False
+            if current_menu_page.get('type', None) in ['int', 'float', 'str'] or current_menu_page.get('searchable', False):
+                configurator_wait_input = True
+
+            users[user_id]['last_message'] = last_message
+            users[user_id]['waiting_for_input'] = configurator_wait_input
+
+    def update_photo(self, user_id: int, photo: bytes) -> None:
+        ''' Обновляет картинку графика или отправляет новую. Новая картинка должна быть над меню,
+         поэтому сообщение меню при этом удаляется. '''
+
+        bot = self.tg_bot
         users = self.tg_users
-        configurator = users[user_id]['configurator']
-        last_message = users[user_id]['last_message']
         last_photo_message = users[user_id]['last_photo_message']
-        current_menu_page = configurator.current_menu_page
-        text = current_menu_page['title'] + ':'
-        photo = None
-        reply_markup = self.generate_buttons(current_menu_page.get('items', []), current_menu_page.get('layout', []))
-
-        if users[user_id].get('loading_message', None) is not None:
-            bot.delete_message(user_id, users[user_id]['loading_message'].message_id)
-            users[user_id]['loading_message'] = None
-
-        if users[user_id].get('error_message', None) is not None:
-            bot.delete_message(user_id, users[user_id]['error_message'].message_id)
-            users[user_id]['error_message'] = None
-
-        if current_menu_page.get('show_graph', None) is not None:
-            photo = self.make_graph_photo(user_id)
-
-        if photo is not None:
-            with open(photo, 'rb') as img:
-                if last_photo_message:
-                    # TODO: если график не изменился, то падает ошибка, стоит присмотреться, если нечего будет делать
-                    try:
-                        bot.edit_message_media(telebot.types.InputMediaPhoto(img), user_id,
-                                               last_photo_message.message_id)
-                    except Exception as err:
-                        self.log_w(user_id, 'show_menu', err)
-                else:
-                    if last_message:
-                        bot.delete_message(user_id, last_message.message_id)
-                        last_message = None
-                    last_photo_message = bot.send_photo(user_id, img)
-        elif last_photo_message:
-            bot.delete_message(user_id, last_photo_message.message_id)
-            last_photo_message = None
-
-        if last_message is not None:
-            bot.edit_message_text(text, user_id, last_message.message_id, reply_markup=reply_markup)
-        else:
-            last_message = bot.send_message(user_id, text, reply_markup=reply_markup)
 
-        configurator_wait_input = False
-        if current_menu_page.get('type', None) in ['int', 'float', 'str']:
-            configurator_wait_input = True
+        # если картинка не изменилась, то телеграм отклоняет edit_message_media, поэтому запоминаем
+        # хэш последней отправленной картинки вместе с id сообщения и не отправляем ее повторно
+        photo_hash = hashlib.blake2b(photo, digest_size=16).hexdigest()
+
+        if last_photo_message:
+            if users[user_id].get('last_photo_hash', None) != (last_photo_message.message_id, photo_hash):
+                try:
+                    bot.edit_message_media(telebot.types.InputMediaPhoto(photo), user_id,
+                                           last_photo_message.message_id)
+                except Exception as err:
+                    self.log_w(user_id, 'update_photo', err)
+        else:
+            if users[user_id]['last_message']:
+                bot.delete_message(user_id, users[user_id]['last_message'].message_id)
+                users[user_id]['last_message'] = None
+            last_photo_message = bot.send_photo(user_id, photo)
 
-        users[user_id]['last_message'] = last_message
         users[user_id]['last_photo_message'] = last_photo_message
-        users[user_id]['waiting_for_input'] = configurator_wait_input
+        users[user_id]['last_photo_hash'] = (last_photo_message.message_id, photo_hash)
 
-    def make_graph_photo(self, user_id: int) -> str:
-        ''' Создает файл графика, указанного в конфигураторе, сохраняет его в файл
-         и возвращает путь к файлу. '''
+    def submit_graph(self, user_id: int) -> None:
+        ''' Заказывает отрисовку превью графика из конфигуратора. Предыдущий заказ пользователя отменяется,
+         готовая картинка кладется в кэш и показывается над меню. '''
 
-        data = None
-        figure = None
-        photo = None
         users = self.tg_users
-        config = users[user_id]['configurator'].config
+        config = dict(users[user_id]['configurator'].config)
+        df_container = users[user_id]['df_container']
+        key = self.make_graph_key(user_id, 'preview')
+
+        future = self.render_service.submit(user_id, lambda cancelled: df_container.make_data(config, cancelled),
+                                            users[user_id]['visualizer'], config,
+                                            on_done=lambda photo: self.on_graph_ready(user_id, key, photo),
+                                            on_error=lambda err: self.show_error(user_id, 'submit_graph', err),
+                                            profile='preview')
+
+        # профили колонок графика (перцентили для меню очистки выбросов) считаются в фоне после превью,
+        # когда колонки уже загружены; уже посчитанные профили не пересчитываются
+        def compute_profile(done):
+            if users[user_id].get('df_container', None) is df_container:
+                df_container.compute_profile(df_container.config_columns(config), background=True)
+
+        future.add_done_callback(compute_profile)
+
+    def on_graph_ready(self, user_id: int, key, photo: bytes) -> None:
+        self.render_cache.put(key, photo)
+
+        with self.user_locks[user_id]:
+            try:
+                menu_deleted = self.tg_users[user_id]['last_photo_message'] is None
+                self.update_photo(user_id, photo)
+
+                # меню было удалено, чтобы картинка оказалась над ним - отправляем его снова
+                if menu_deleted:
+                    self.show_menu(user_id)
+            except Exception as err:
+                self.log_w(user_id, 'on_graph_ready', err)
+
+    def report_progress(self, user_id: int, done: int, total: int = None) -> None:
+        ''' Показывает, сколько скачано, отдельным сообщением (не чаще раза в секунду) '''
+        users = self.tg_users
+        now = time.monotonic()
+
+        if now - users[user_id].get('progress_time', 0) < 1:
+            return
+
+        users[user_id]['progress_time'] = now
+        text = f'Скачано {done >> 20} МБ' + (f' из {total >> 20} МБ' if total else '')
+
+        try:
+            if users[user_id].get('progress_message', None) is None:
+                users[user_id]['progress_message'] = self.tg_bot.send_message(user_id, text)
+            else:
+                self.tg_bot.edit_message_text(text, user_id, users[user_id]['progress_message'].message_id)
+        except Exception as err:
+            self.log_w(user_id, 'report_progress', err)
+
+    def finish_progress(self, user_id: int) -> None:
+        users = self.tg_users
+
+        if users[user_id].get('progress_message', None) is not None:
+            try:
+                self.tg_bot.delete_message(user_id, users[user_id]['progress_message'].message_id)
+            except Exception as err:
+                self.log_w(user_id, 'finish_progress', err)
+
+        users[user_id]['progress_message'] = None
+        users[user_id]['progress_time'] = 0
+
+    def download_document(self, user_id: int, telegram_path: str, file_name: str):
+        ''' Скачивает присланный документ потоково во временный файл в директории пользователя и атомарно
+         переименовывает его в итоговый. Если файл с таким же содержимым уже загружался, временный файл удаляется
+         и возвращается путь к существующему. Возвращает (путь, дубликат ли). '''
+
+        user_dir = self.user_dir(user_id)
+        tmp_path = f'{user_dir}.{file_name}.upload'
+        url = f'https://api.telegram.org/file/bot{self.tg_token}/{telegram_path}'
+
+        try:
+            result = self.downloader.download(url, tmp_path, check=self.check_csv)
+            duplicate = self.get_uploads(user_id).get(result['hash'], None)
+
+            if duplicate is not None and os.path.exists(user_dir + duplicate):
+                return user_dir + duplicate, True
+
+            src = user_dir + file_name
+            os.replace(tmp_path, src)
+
+            self.remember_upload(user_id, file_name, result['hash'])
+            # хэш уже посчитан при скачивании, реестру общих датафреймов не нужно читать файл заново
+            self.data_ready.wait()
+
+            if self.frame_registry is not None:
+                self.frame_registry.remember(src, result['hash'])
+
+            return src, False
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def get_uploads(self, user_id: int) -> dict:
+        ''' Хэши содержимого загруженных файлов пользователя: {хэш: имя файла} '''
+        try:
+            with open(self.user_dir(user_id) + '.uploads.json') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return dict()
+
+    def save_uploads(self, user_id: int, uploads: dict) -> None:
+        path = self.user_dir(user_id) + '.uploads.json'
+
+        with open(path + '.tmp', 'w') as f:
+            json.dump(uploads, f)
+
+        os.replace(path + '.tmp', path)
+
+    def remember_upload(self, user_id: int, file_name: str, content_hash: str) -> None:
+        uploads = {key: name for key, name in self.get_uploads(user_id).items() if name != file_name}
+        uploads[content_hash] = file_name
+        self.save_uploads(user_id, uploads)
+
+    def forget_upload(self, user_id: int, file_name: str) -> None:
+        uploads = self.get_uploads(user_id)
+        self.save_uploads(user_id, {key: name for key, name in uploads.items() if name != file_name})
+
+    def load_container(self, file_path: str):
+        ''' Проверяет и загружает файл пользователя, возвращает (контейнер, None) или (None, текст ошибки).
+         Файлы больше memory_limit обрабатываются потоково, не загружаясь в память целиком. '''
+
+        # pandas и реестр общих датафреймов загружаются фоновым прогревом
+        self.data_ready.wait()
+
+        from DataFrameContainer import DataFrameContainer
+
+        df_container, error_text = DataFrameContainer.load_csv(
+            file_path, optimize=True, lazy=True, chunked='auto', memory_limit=self.memory_limit,
+            result_cache=self.result_cache, stage_cache=self.stage_cache, registry=self.frame_registry
+        )
+
+        return df_container, error_text
+
+    def make_graph_key(self, user_id: int, profile: str = 'final') -> tuple:
+        ''' Ключ картинки графика в кэше: данные графика, полный конфиг и профиль качества '''
+
+        config = self.tg_users[user_id]['configurator'].config
+        df_container = self.tg_users[user_id]['df_container']
+
+        return df_container.make_data_key(config), json.dumps(config, sort_keys=True, default=str), profile
+
+    def make_graph_photo(self, user_id: int, profile: str = 'final') -> bytes:
+        ''' Синхронно возвращает картинку графика, указанного в конфигураторе. Картинка берется из кэша,
+         при промахе рисуется в пуле процессов сервиса отрисовки. '''
+
+        users = self.tg_users
+        config = dict(users[user_id]['configurator'].config)
         df_container = users[user_id]['df_container']
         visualizer = users[user_id]['visualizer']
 
-        if config['graph_type'] == 'bar':
-            data = df_container.make_bar_data(config)
-            figure = visualizer.make_bar_plot(data, title=config['graph_title'], **config)
-        elif config['graph_type'] == 'scatter':
-            data = df_container.make_scatter_data(config)
-            figure = visualizer.make_scatter_plot(data, title=config['graph_title'], **config)
-        elif config['graph_type'] == 'hist':
-            data = df_container.make_hist_data(config)
-            figure = visualizer.make_hist_plot(data, title=config['graph_title'], **config)
-        elif config['graph_type'] == 'pie':
-            data = df_container.make_pie_data(config)
-            figure = visualizer.make_pie_chart(data['y'], labels=data['x'], title=config['graph_title'], **config)
+        return self.render_cache.get_or_compute(
+            self.make_graph_key(user_id, profile),
+            lambda: self.render_service.render(visualizer, df_container.make_data(config), config, profile)
+        )
+
+    def send_dashboard(self, user_id: int) -> None:
+        ''' Отправляет готовые графики пользователя одной картинкой. Общие стадии подготовки данных
+         считаются один раз на все графики, панели рисуются в одной фигуре в пуле процессов. '''
 
-        my_dir = self.user_dir(user_id) + 'tmp/'
+        users = self.tg_users
+        bot = self.tg_bot
+        configs = [dict(config) for config in users[user_id]['configurator'].dashboard]
+        df_container = users[user_id]['df_container']
+        visualizer = users[user_id]['visualizer']
+        key = ('dashboard', tuple((df_container.make_data_key(config), json.dumps(config, sort_keys=True, default=str))
+                                  for config in configs))
 
-        if not os.path.exists(my_dir):
-            os.makedirs(my_dir)
+        try:
+            photo = self.render_cache.get_or_compute(
+                key, lambda: self.render_service.render_dashboard(visualizer, df_container.make_dashboard_data(configs),
+                                                                  configs)
+            )
+        except Exception as err:
+            self.show_error(user_id, 'send_dashboard', err)
+            return
 
-        photo = my_dir + 'cur_graph.png'
-        figure.savefig(photo)
+        with self.user_locks[user_id]:
+            if users[user_id]['last_message']:
+                bot.delete_message(user_id, users[user_id]['last_message'].message_id)
+                users[user_id]['last_message'] = None
+            # дашборд и последний график остаются в чате, меню отправляется под ними
+            users[user_id]['last_photo_message'] = None
+            bot.send_photo(user_id, photo)
 
-        return photo
+        self.send_or_update(user_id)
 
     def send_or_update(self, user_id: int):
         ''' Обновляет меню или создает новое, если работа с предыдущим графиком зваершена. '''
         users = self.tg_users
         bot = self.tg_bot
 
+        self.sessions.touch(user_id, users[user_id]['df_container'])
+
         try:
             self.show_menu(user_id)
         except Exception as err:
-            self.log_w(user_id, 'send_or_update', err)
+            self.show_error(user_id, 'send_or_update', err)
+
+    def show_error(self, user_id: int, function: str, err: Exception):
+        ''' Сообщает об ошибке построения и возвращает пользователя на предыдущую страницу меню '''
+        users = self.tg_users
+        bot = self.tg_bot
+
+        with self.user_locks[user_id]:
+            self.log_w(user_id, function, err)
             error_text = 'Что-то пошло не так, попробуйте снова.'
             if users[user_id]['last_photo_message']:
                 bot.delete_message(user_id, users[user_id]['last_photo_message'].message_id)
@@ -220,6 +508,13 @@ class Main:
     def start(self, user_id):
         bot = self.tg_bot
         users = self.tg_users
+        started = time.perf_counter()
+
+        self.render_service.cancel(user_id)
+        self.sessions.remove(user_id)
+
+        if users[user_id].get('df_container', None) is not None:
+            users[user_id]['df_container'].release()
 
         if 'last_message' in users[user_id] and users[user_id]['last_message'] is not None:
             bot.delete_message(user_id, users[user_id]['last_message'].message_id)
@@ -251,11 +546,27 @@ class Main:
 
         self.send_msg(reply_msg, user_id, users_files['keybord'])
 
+        if self.startup['first_response'] is None:
+            self.startup['first_response'] = time.perf_counter() - process_started
+            self.startup['first_response_handling'] = time.perf_counter() - started
+            self.log_w(-1, 'first_response', self.startup_report())
+
     def next_graph(self, user_id: int):
         ''' Создает новый график '''
         bot = self.tg_bot
         users = self.tg_users
 
+        # готовый график должен успеть появиться до сброса конфигуратора
+        self.render_service.wait(user_id)
+
+        # превью заменяется картинкой в полном качестве
+        if users[user_id]['last_photo_message']:
+            try:
+                with self.user_locks[user_id]:
+                    self.update_photo(user_id, self.make_graph_photo(user_id))
+            except Exception as err:
+                self.log_w(user_id, 'next_graph', err)
+
         users[user_id]['configurator'].reset()
 
         if users[user_id]['last_message']:
@@ -299,26 +610,41 @@ class Main:
 
                     elif msg_mtm not in users[user_id]['files']:
                         url = msg_mtm
-                        r = requests.get(url)
                         cur_file = self.user_dir(user_id) + str(url.split('/')[-1])
 
-                        # Валидация файла
-                        with open(cur_file, 'wb') as f:
-                            f.write(r.content)
+                        try:
+                            # начало файла проверяется как csv, пока остальное еще качается
+                            result = self.downloader.download(url, cur_file,
+                                                              progress=lambda done, total: self.report_progress(user_id, done, total),
+                                                              check=self.check_csv)
+                            # файл мог перезаписать загруженный ранее с тем же именем, запись о хэше обновляется
+                            self.remember_upload(user_id, os.path.basename(cur_file), result['hash'])
+                        except DownloadError as err:
+                            self.forget_upload(user_id, os.path.basename(cur_file))
+                            self.send_msg(f'Не удалось скачать файл: {err}\nПопробуйте снова: /start', user_id)
+                            return
+                        finally:
+                            self.finish_progress(user_id)
 
-                        valid = DataFrameContainer.validate_csv(cur_file)
-                        if valid:
-                            self.send_msg('Данные загружены!', message.from_user.id)
-                        else:
-                            os.remove(cur_file)
-                            self.send_msg('К сожалению файл не валиден... Попробуйте снова.', message.from_user.id)
+                    else:
+                        cur_file = self.user_dir(user_id) + '/' + str(msg_mtm)
 
+                    # Валидация и загрузка файла за один разбор
+                    df_container, error_text = self.load_container(cur_file)
 
+                    if df_container is None:
+                        if msg_mtm not in users[user_id]['files'] and msg_mtm != '/test':
+                            self.forget_upload(user_id, os.path.basename(cur_file))
+                            os.remove(cur_file)
+                        self.send_msg(f'К сожалению файл не валиден: {error_text}\nПопробуйте снова: /start', user_id)
+                        return
 
-                    else:
-                        cur_file = self.user_dir(user_id) + '/' + str(msg_mtm)
+                    if msg_mtm not in users[user_id]['files'] and msg_mtm != '/test':
+                        self.send_msg('Данные загружены!', message.from_user.id)
+
+                    self.log_w(user_id, 'get_text_messages', f'memory: {df_container.memory_report}')
 
-                    users[user_id]['df_container'] = DataFrameContainer(cur_file)
+                    users[user_id]['df_container'] = df_container
                     users[user_id]['configurator'] = ConcreteConfigurator(users[user_id]['df_container'])
                     users[user_id]['configurator'].set_file_name(msg_mtm)
 
@@ -339,7 +665,9 @@ class Main:
                     users[user_id]['error_message'] = None
 
                 try:
-                    users[user_id]['configurator'].update_menu_state(message.text)
+                    # на страницах со списком колонок введенный текст - поисковый запрос
+                    command = 'search' if users[user_id]['configurator'].current_menu_page.get('searchable', False) else None
+                    users[user_id]['configurator'].update_menu_state(message.text, command)
                     users[user_id]['waiting_for_input'] = False
                     self.send_or_update(user_id)
                 except ValueError as err:
@@ -371,6 +699,8 @@ class Main:
                 self.next_graph(user_id)
             elif command == 'change_file':
                 self.start(user_id)
+            elif command == 'dashboard':
+                self.send_dashboard(user_id)
             else:
                 bot.edit_message_text(users[user_id]['last_message'].text + ' обработка...', user_id,
                                         users[user_id]['last_message'].message_id)
@@ -386,27 +716,27 @@ class Main:
                 try:
                     self.send_msg('Загрузка и проверка...', message.from_user.id)
                     file_info = bot.get_file(message.document.file_id)
-                    downloaded_file = bot.download_file(file_info.file_path)
+                    file_name = message.document.file_name
 
-                    user_dic = self.user_dir(user_id)
+                    # файл пишется на диск блоками, начало проверяется как csv еще во время скачивания
                     try:
-                        os.mkdir(user_dic)
-                    except Exception as err:
-                        self.log_w(user_id, 'handle_docs', err)
+                        src, is_duplicate = self.download_document(user_id, file_info.file_path, file_name)
+                    except DownloadError as err:
+                        self.send_msg(f'К сожалению файл не валиден: {err}\nПопробуйте снова.', message.from_user.id)
+                        return
 
-                    file_name = message.document.file_name
-                    src = user_dic + file_name
-                    with open(src, 'wb') as new_file:
-                        new_file.write(downloaded_file)
+                    if is_duplicate:
+                        file_name = os.path.basename(src)
+                        self.send_msg(f'Такой файл уже загружен: {file_name}', message.from_user.id)
 
-                    #  Проверка файла на валидность
+                    #  Проверка файла на валидность и загрузка за один разбор
 
-                    valide = DataFrameContainer.validate_csv(src)
+                    df_container, error_text = self.load_container(src)
 
-                    if valide:
+                    if df_container is not None:
                         self.send_msg('Успешно!', message.from_user.id)
-                        cur_file = src
-                        users[user_id]['df_container'] = DataFrameContainer(cur_file)
+                        self.log_w(user_id, 'handle_docs', f'memory: {df_container.memory_report}')
+                        users[user_id]['df_container'] = df_container
                         users[user_id]['configurator'] = ConcreteConfigurator(users[user_id]['df_container'])
                         users[user_id]['configurator'].set_file_name(file_name)
 
@@ -414,8 +744,11 @@ class Main:
 
                         self.send_or_update(user_id)
                     else:
-                        os.remove(src)
-                        self.send_msg('К сожалению файл не валиден... Попробуйте снова.', message.from_user.id)
+                        # дубликат указывает на ранее загруженный файл, его удалять нельзя
+                        if not is_duplicate:
+                            self.forget_upload(user_id, file_name)
+                            os.remove(src)
+                        self.send_msg(f'К сожалению файл не валиден: {error_text}\nПопробуйте снова.', message.from_user.id)
                 except Exception as err:
                     self.send_msg(f'Ошибка загрузки :(', message.from_user.id)
                     self.log_w(message.from_user.id, 'handle_docs', err)
@@ -426,13 +759,15 @@ class Main:
     def run_bot(self) -> None:
         ''' Запусить бот '''
         self.processing()
+        self.sessions.start()
+        # бот начинает отвечать сразу, тяжелые библиотеки загружаются параллельно
+        threading.Thread(target=self.warm_up, name='warm-up', daemon=True).start()
 
-        def th():
-            self.tg_bot.polling(none_stop=True)
-
-        import threading
-        my_thread = threading.Thread(target=th)
-        my_thread.start()
+        try:
+            self.runtime.run()
+        finally:
+            self.sessions.stop()
+            self.render_service.shutdown()
 
 
 if __name__ == '__main__':